@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+'''Benchmarks for the DSL hot paths and the built-in matchers.
+
+    python run_benchmarks.py                      # run and print the results
+    python run_benchmarks.py --save base.json     # save the results
+    python run_benchmarks.py --compare base.json  # compare with saved results
+
+Each benchmark is timed several times, keeping the best time per operation
+and, as its noise, how far the median time is from the best one. When
+comparing, a benchmark is slower if it lost more than the threshold (25% by
+default), more than the minimum difference (0.1 us by default) and more than
+the noise of both runs. Slower benchmarks are timed again a few times before
+being reported, and the exit status is 1 if any is still slower. It needs
+Python 3.5 or newer.
+'''
+import sys
+import json
+import platform
+import argparse
+from timeit import Timer
+
+from should_dsl import should, should_not, expect, matches, evaluate, matcher
+from should_dsl import matchers
+
+
+BENCHMARKS = []
+
+def benchmark(name, statement, setup='pass', namespace=None, prepare=None):
+    '''Adds a benchmark. prepare, if given, is called before timing it'''
+    BENCHMARKS.append((name, statement, setup, namespace or {}, prepare))
+
+
+def dsl_benchmarks():
+    names = {'should': should, 'should_not': should_not, 'expect': expect,
+             'matches': matches, 'equal_to': matchers.equal_to}
+    benchmark('overhead/assert', 'assert 1 == 1')
+    benchmark('overhead/should', '1 |should| equal_to(1)', namespace=names)
+    benchmark('overhead/should_not', '1 |should_not| equal_to(2)',
+              namespace=names)
+    benchmark('overhead/expect', 'expect(1).to(equal_to(1))', namespace=names)
+    benchmark('overhead/matches', 'matches(1, equal_to(1))', namespace=names)
+
+
+def registered_matchers_benchmarks():
+    '''should only looks up the names used by the expectation, so the time
+    shouldn't grow with the number of registered matchers'''
+    names = {'should': should, 'equal_to': matchers.equal_to}
+    for count in (0, 100, 1000):
+        benchmark('registered_matchers/%d' % count, '1 |should| equal_to(1)',
+                  namespace=names, prepare=_registering_matchers(count))
+
+def _registering_matchers(count):
+    def prepare():
+        for index in range(count):
+            _register_matcher('benchmark_matcher_%d' % index)
+    return prepare
+
+def _register_matcher(name):
+    def function():
+        return (lambda x, y: x == y, '%r is %sequal to %r')
+    function.__name__ = name
+    matcher(function)
+
+
+def lvalue_dir_benchmarks():
+    '''Predicate matchers depend on the lvalue attributes, from its class
+    and from its instance __dict__'''
+    for size in (10, 100, 1000):
+        attributes = dict(('attribute_%d' % i, i) for i in range(size))
+        attributes['is_valid'] = True
+        klass = type('Lvalue%d' % size, (object,), attributes)
+        names = {'should': should, 'lvalue': klass()}
+        benchmark('lvalue_dir/%d' % size, 'lvalue |should| be_valid',
+                  namespace=names)
+    for size in (10, 100, 1000, 10000):
+        klass = type('InstanceLvalue%d' % size, (object,), {'is_valid': True})
+        lvalue = klass()
+        for i in range(size):
+            setattr(lvalue, 'attribute_%d' % i, i)
+        names = {'should': should, 'lvalue': lvalue}
+        benchmark('lvalue_dir/instance/%d' % size, 'lvalue |should| be_valid',
+                  namespace=names)
+
+
+def matcher_benchmarks():
+    sizes = {'small': 10, 'large': 10000}
+    for label, size in sizes.items():
+        values = list(range(size))
+        names = {'values': values, 'reversed_values': values[::-1],
+                 'text': 'should dsl ' * size, 'mapping': dict.fromkeys(values, 1),
+                 'floats': [1.0] * size, 'size': size, 'last': size - 1}
+        names.update(vars(matchers))
+        checks = [
+            ('be', 'matches(values, be(values))'),
+            ('equal_to', 'matches(values, equal_to(list(values)))'),
+            ('equal_to_diff', 'evaluate(text, equal_to(text + "x", diff=True)).reason'),
+            ('equal_to_ignoring_case', 'matches(text, equal_to_ignoring_case(text.upper()))'),
+            ('include', 'matches(values, include(last))'),
+            ('include_in_any_order', 'matches(values, include_in_any_order(reversed_values))'),
+            ('include_all_of', 'matches(values, include_all_of(reversed_values))'),
+            ('include_keys', 'matches(mapping, include_keys(last))'),
+            ('include_values', 'matches(mapping, include_values(1))'),
+            ('have', 'matches(values, have(size).elements)'),
+            ('be_empty', 'matches(values, be_empty)'),
+            ('be_greater_than', 'matches(last, be_greater_than(0))'),
+            ('close_to', 'matches(floats, close_to(1, 0.1))'),
+            ('each', 'matches(values, each(be_greater_than_or_equal_to(0)))'),
+            ('be_like', r'matches(text, be_like(r"dsl\s*$"))'),
+            ('start_with', 'matches(text, start_with("should"))'),
+            ('be_instance_of', 'matches(values, be_instance_of(list))'),
+            ('throw', 'matches(lambda: values.index(-1), throw(ValueError))'),
+            ('change', 'matches(lambda: values.append(1) or values.pop(), change(lambda: len(values)))'),
+            ('all_of_matchers', 'matches(values, all_of_matchers(be_instance_of(list), have(size).elements))'),
+        ]
+        names['matches'], names['evaluate'] = matches, evaluate
+        for name, statement in checks:
+            benchmark('matchers/%s/%s' % (name, label), statement,
+                      namespace=names)
+
+
+# times a slower benchmark is timed again before being reported
+RETRIES = 3
+
+
+def time_per_operation(statement, setup, namespace, repeat):
+    '''Returns the best time per operation and the noise of the timings,
+    the difference between their median and the best one'''
+    timer = Timer(statement, setup, globals=namespace)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= 0.05 or number >= 10 ** 7:
+            break
+        number *= 10
+    times = sorted(elapsed / number for elapsed in timer.repeat(repeat, number))
+    return times[0], times[len(times) // 2] - times[0]
+
+
+def run(selection, repeat):
+    dsl_benchmarks()
+    lvalue_dir_benchmarks()
+    matcher_benchmarks()
+    registered_matchers_benchmarks()
+    results, noise = {}, {}
+    for name, statement, setup, namespace, prepare in BENCHMARKS:
+        if selection and selection not in name:
+            continue
+        if prepare is not None:
+            prepare()
+        results[name], noise[name] = time_per_operation(statement, setup,
+                                                        namespace, repeat)
+        print('%-48s %12.3f us' % (name, results[name] * 1e6))
+    return results, noise
+
+
+def retimer(repeat):
+    '''Returns a function timing again a benchmark that already ran'''
+    benchmarks = dict((entry[0], entry[1:4]) for entry in BENCHMARKS)
+    def retime(name):
+        statement, setup, namespace = benchmarks[name]
+        return time_per_operation(statement, setup, namespace, repeat)[0]
+    return retime
+
+
+def compare(results, baseline, threshold, min_difference=0.0, noise=None,
+            baseline_noise=None, retime=None):
+    '''Returns the names of the benchmarks slower than the baseline. A
+    benchmark is slower if it lost more than threshold (a ratio), more than
+    min_difference seconds and more than the noise of both runs. With retime,
+    slower benchmarks are timed again, keeping their best time, before being
+    reported'''
+    noise = noise or {}
+    baseline_noise = baseline_noise or {}
+    def slower(name):
+        allowed = max(baseline[name] * threshold, min_difference,
+                      noise.get(name, 0.0) + baseline_noise.get(name, 0.0))
+        return results[name] - baseline[name] > allowed
+    regressions = []
+    print('')
+    print('%-48s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for retry in range(retime and RETRIES or 0):
+            if not slower(name):
+                break
+            results[name] = min(results[name], retime(name))
+        ratio = results[name] / baseline[name]
+        flag = ''
+        if slower(name):
+            regressions.append(name)
+            flag = '  slower'
+        print('%-48s %9.3f us %9.3f us %7.2fx%s' % (name, baseline[name] * 1e6,
+            results[name] * 1e6, ratio, flag))
+    if regressions:
+        print('\n%d benchmarks slower than %d%% over the baseline, beyond the noise' % (
+            len(regressions), threshold * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as JSON to FILE')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown ratio reported as regression (0.25)')
+    parser.add_argument('--min-difference', type=float, default=0.1,
+                        help='slowdown in microseconds below which '
+                             'benchmarks are never reported (0.1)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='times each benchmark is repeated (5)')
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks whose name include FILTER')
+    options = parser.parse_args()
+
+    results, noise = run(options.filter, options.repeat)
+    if options.save:
+        output = open(options.save, 'w')
+        try:
+            json.dump({'python': platform.python_version(),
+                       'implementation': platform.python_implementation(),
+                       'benchmarks': results, 'noise': noise},
+                      output, indent=2, sort_keys=True)
+        finally:
+            output.close()
+    if options.compare:
+        saved = json.load(open(options.compare))
+        if compare(results, saved['benchmarks'], options.threshold,
+                   options.min_difference * 1e-6, noise, saved.get('noise'),
+                   retimer(options.repeat)):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
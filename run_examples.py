@@ -1,14 +1,36 @@
 #!/usr/bin/env python
+import os
 import doctest
 import unittest
 import sys
 
+# examples of optional integrations, skipped when the module is missing
+optional_modules = {'numpy_arrays.txt': 'numpy'}
+# examples needing a newer Python than the oldest supported one (asyncio.run
+# and contextvars), left out on older versions
+minimum_versions = {'asynchronous.txt': (3, 7), 'asyncio_tasks.txt': (3, 7)}
+
 def test_suite(docs):
     suite = unittest.TestSuite()
     for doc in docs:
-        suite.addTest(doctest.DocFileSuite(doc, optionflags=flags()))
+        name = os.path.basename(doc)
+        if sys.version_info < minimum_versions.get(name, ()):
+            continue
+        module = optional_modules.get(name)
+        suite.addTest(doctest.DocFileSuite(doc, optionflags=flags(),
+                                           setUp=requiring(module)))
     return suite
 
+def requiring(module):
+    def set_up(test):
+        if module is None:
+            return
+        try:
+            __import__(module)
+        except ImportError:
+            raise unittest.SkipTest('%s is not installed' % module)
+    return set_up
+
 def flags():
     flags = doctest.NORMALIZE_WHITESPACE|doctest.ELLIPSIS
     if sys.version_info >= (3,):
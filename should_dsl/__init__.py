@@ -1,9 +1,24 @@
 from should_dsl.dsl import (should,
                          should_not,
+                         expect,
+                         matches,
+                         fails,
+                         evaluate,
+                         MatchResult,
                          matcher,
                          add_predicate_regex,
                          matcher_configuration,
                          aliases,
+                         enable_profiling,
+                         disable_profiling,
+                         add_hooks,
+                         remove_hooks,
+                         Profiler,
                          ShouldNotSatisfied)
+from should_dsl.reprs import (bounded_repr,
+                              bounded_str,
+                              repr_configuration,
+                              add_repr_for_type)
+from should_dsl.validation import RecordValidator, verify_all
 from should_dsl import matchers
 
@@ -0,0 +1,136 @@
+'''Expectations for asyncio code (Python 3.5 or newer):
+
+    await expect_async(fetch_user(1)).to(include_keys('name'))
+    await expect_async(connect).to(throw(TimeoutError))
+    await expect_async(import_batch).to(change(count_rows).by(10))
+
+Awaitable actual values are awaited before being matched. throw, be_thrown_by,
+change, change_all and eventually call their functions and await what they
+return, so coroutine functions run in the event loop instead of blocking it.
+'''
+
+import asyncio
+import inspect
+
+from should_dsl.dsl import (_as_matcher, _inject_negate_information,
+                            _FunctionMatcher, ShouldNotSatisfied)
+from should_dsl.matchers import (Throw, Change, ChangeAll, Eventually,
+                                 check_exception, _function_and_args)
+
+
+async def _resolve(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+async def _call(callable_and_possible_params):
+    '''Calls a function (or a coroutine function), awaiting its result. A
+    coroutine object is just awaited'''
+    if inspect.isawaitable(callable_and_possible_params):
+        return await callable_and_possible_params
+    function, args = _function_and_args(callable_and_possible_params)
+    return await _resolve(function(*args))
+
+
+async def check_exception_async(expected_exception, callable_and_possible_params):
+    try:
+        await _call(callable_and_possible_params)
+        return False
+    except expected_exception:
+        return True
+    except Exception:
+        return False
+
+
+async def _match_throw(matcher, lvalue):
+    matcher._lvalue = lvalue
+    try:
+        await _call(lvalue)
+    except matcher._expected_exception as e:
+        return matcher._expected_exception_thrown(e)
+    except Exception as e:
+        return matcher._other_exception_thrown(e)
+    return matcher._no_exception_thrown()
+
+async def _match_change(matcher, action):
+    matcher._take_snapshot(await _resolve(matcher._verifier()))
+    await _call(action)
+    return matcher._compare_with_snapshot(await _resolve(matcher._verifier()))
+
+async def _match_change_all(matcher, action):
+    for change in matcher._changes:
+        change._take_snapshot(await _resolve(change._verifier()))
+    await _call(action)
+    results = []
+    for change in matcher._changes:
+        results.append(await _resolve(change._verifier()))
+    return matcher._compare_with_snapshots(results)
+
+async def _match_eventually(matcher, function):
+    matcher._start(function)
+    while True:
+        wait = matcher._attempt(await _resolve(function()))
+        if wait is None:
+            return matcher._matched
+        await asyncio.sleep(wait)
+
+async def _match_function_matcher(matcher, value):
+    function = _async_verifiers.get(matcher._matcher_class.function)
+    if function is None:
+        return matcher.match(await _resolve(value))
+    matcher._value = value
+    return await function(value, matcher._arg)
+
+
+# matchers whose match runs functions given as the actual value
+_async_matches = {
+    Throw: _match_throw,
+    Change: _match_change,
+    ChangeAll: _match_change_all,
+    Eventually: _match_eventually,
+    _FunctionMatcher: _match_function_matcher,
+}
+
+# function matchers verifiers that run functions
+_async_verifiers = {
+    check_exception: check_exception_async,
+}
+
+
+def _async_match_for(matcher):
+    for klass in type(matcher).__mro__:
+        match = _async_matches.get(klass)
+        if match is not None:
+            return match
+    return None
+
+
+class AsyncExpectation(object):
+    '''expect() for asyncio code, whose to and not_to must be awaited'''
+
+    def __init__(self, actual):
+        self._actual = actual
+
+    async def to(self, matcher):
+        await self._check(matcher, False)
+
+    async def not_to(self, matcher):
+        await self._check(matcher, True)
+
+    async def _check(self, matcher, negate):
+        matcher = _as_matcher(matcher)
+        _inject_negate_information(matcher, negate)
+        match = _async_match_for(matcher)
+        if match is None:
+            actual = await _resolve(self._actual)
+            matched = matcher.match(actual)
+        else:
+            actual = self._actual
+            matched = await match(matcher, actual)
+        if bool(matched) == negate:
+            raise ShouldNotSatisfied(matcher=matcher, actual=actual,
+                                     negate=negate)
+
+
+def expect_async(actual):
+    return AsyncExpectation(actual)
@@ -2,5 +2,17 @@ import sys
 
 if sys.version_info >= (3,):
     string_types = (str,)
+    integer_types = (int,)
 else:
     string_types = (basestring,)
+    integer_types = (int, long)
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+try:
+    from reprlib import Repr
+except ImportError:
+    from repr import Repr
@@ -1,169 +1,743 @@
 import sys
 import re
-from types import FunctionType
+import weakref
+import threading
+from collections import namedtuple, OrderedDict
+from types import FunctionType, CodeType
+from timeit import default_timer
+from should_dsl.reprs import bounded, bounded_repr, bounded_str
 
 
 _predicate_regexes = set(['is_(.+)', 'is(.+)'])
 
 
+class _PredicateMatcherNames(object):
+    '''Maps the be_* names available for an object to the attributes they check.
+
+    While the predicate regexes are all like "is_(.+)", the attributes a
+    be_* name can check are looked up directly on the instance and its
+    classes. Otherwise, dir() and the regexes are run once per type and the
+    names found in an instance's __dict__ are resolved on every lookup.
+    '''
+
+    def __init__(self, regexes):
+        self._regexes = regexes
+        self.clear()
+
+    def clear(self):
+        self._tables_by_type = {}
+        self._names_by_attr = {}
+        self._compiled_regexes = [re.compile(regex) for regex in self._regexes]
+        try:
+            self._any_regex = re.compile('|'.join(
+                ['(?:%s)' % regex for regex in self._regexes]))
+        except re.error:
+            self._any_regex = None
+        self._prefixes = self._literal_prefixes(self._regexes)
+
+    def _literal_prefixes(self, regexes):
+        '''Returns the prefixes of regexes like "is_(.+)", which build an
+        attribute name from a predicate name, or None if a regex is not like
+        that'''
+        prefixes = []
+        for regex in regexes:
+            r = re.match(r'(\w*)\(\.\+\)$', regex)
+            if r is None:
+                return None
+            prefixes.append(r.group(1))
+        return prefixes
+
+    def resolve(self, obj, matcher_names):
+        '''Returns a {matcher_name: attr_name} dict for the given be_* names
+        that are available as predicate matchers on obj'''
+        if self._prefixes is not None and self._is_cacheable(obj, type(obj)):
+            return self._resolve_directly(obj, matcher_names)
+        type_table, instance_names = self._tables_for(obj)
+        instance_table = {}
+        if instance_names:
+            self._add_names(instance_table, instance_names)
+        resolved = {}
+        for matcher_name in matcher_names:
+            candidates = [attr_name for attr_name in (
+                type_table.get(matcher_name), instance_table.get(matcher_name))
+                if attr_name is not None]
+            if not candidates:
+                continue
+            predicate_name = matcher_name[3:]
+            if predicate_name in candidates:
+                resolved[matcher_name] = predicate_name
+            else:
+                resolved[matcher_name] = max(candidates)
+        return resolved
+
+    def _resolve_directly(self, obj, matcher_names):
+        namespaces = [getattr(obj, '__dict__', {})]
+        namespaces.extend([vars(base) for base in type(obj).__mro__])
+        resolved = {}
+        for matcher_name in matcher_names:
+            predicate_name = matcher_name[3:]
+            if not predicate_name:
+                continue
+            if self._is_defined(predicate_name, namespaces):
+                resolved[matcher_name] = predicate_name
+                continue
+            attr_names = [prefix + predicate_name for prefix in self._prefixes
+                          if self._is_defined(prefix + predicate_name, namespaces)]
+            if attr_names:
+                resolved[matcher_name] = max(attr_names)
+        return resolved
+
+    def _is_defined(self, attr_name, namespaces):
+        if attr_name.startswith('_'):
+            return False
+        for namespace in namespaces:
+            if attr_name in namespace:
+                return True
+        return False
+
+    def _tables_for(self, obj):
+        klass = type(obj)
+        if not self._is_cacheable(obj, klass):
+            return self._build_table(dir(obj)), ()
+        cached = self._tables_by_type.get(klass)
+        if cached is None or not self._is_current(klass, cached[0]):
+            cached = (self._attr_names_by_base(klass),
+                      self._build_table(dir(klass)))
+            self._tables_by_type[klass] = cached
+        instance_names = [attr_name for attr_name in getattr(obj, '__dict__', ())
+                          if not attr_name.startswith('_')]
+        return cached[1], instance_names
+
+    def _attr_names_by_base(self, klass):
+        return [frozenset(vars(base)) for base in klass.__mro__]
+
+    def _is_current(self, klass, attr_names_by_base):
+        # comparing the names themselves, as an attribute may be deleted
+        # and another one added
+        mro = klass.__mro__
+        if len(mro) != len(attr_names_by_base):
+            return False
+        for base, attr_names in zip(mro, attr_names_by_base):
+            namespace = vars(base)
+            if (len(namespace) != len(attr_names) or
+                    not attr_names.issuperset(namespace)):
+                return False
+        return True
+
+    def _is_cacheable(self, obj, klass):
+        return (getattr(obj, '__class__', None) is klass and
+                hasattr(klass, '__mro__') and
+                getattr(klass, '__dir__', None) is getattr(object, '__dir__', None))
+
+    def _build_table(self, attr_names):
+        table = {}
+        self._add_names(table, [attr_name for attr_name in attr_names
+                                if not attr_name.startswith('_')])
+        return table
+
+    def _add_names(self, table, attr_names):
+        attr_names = sorted(attr_names)
+        for attr_name in attr_names:
+            for predicate_name in self._predicate_names(attr_name):
+                matcher_name = 'be_' + predicate_name
+                current = table.get(matcher_name)
+                if current is None or (current != predicate_name and current < attr_name):
+                    table[matcher_name] = attr_name
+        for attr_name in attr_names:
+            table['be_' + attr_name] = attr_name
+
+    def _predicate_names(self, attr_name):
+        try:
+            return self._names_by_attr[attr_name]
+        except KeyError:
+            pass
+        names = []
+        if self._any_regex is None or self._any_regex.match(attr_name):
+            for regex in self._compiled_regexes:
+                r = regex.match(attr_name)
+                if r:
+                    names.append(r.group(1))
+        names = tuple(names)
+        self._names_by_attr[attr_name] = names
+        return names
+
+
+_predicate_matcher_names = _PredicateMatcherNames(_predicate_regexes)
+
+
+class _Evaluation(object):
+    '''State of one expectation, from "lvalue |should|" until its matcher runs'''
+
+    # time spent by should in "lvalue |should|", when instrumented
+    overhead = None
+    released = False
+    # asyncio task running the coroutine that started the expectation
+    task = None
+
+    def __init__(self, lvalue, negate, frame, matchers):
+        self.lvalue = lvalue
+        self.negate = negate
+        self.frame = frame
+        self.lasti = frame.f_lasti
+        self.namespace = frame.f_globals
+        self.matchers = matchers
+        if frame.f_code.co_flags & _COROUTINE_CODE_FLAGS:
+            self.task = _current_task()
+            if self.task is not None:
+                self.task.add_done_callback(self._task_done)
+
+    def create_matcher(self, name):
+        matcher = self.matchers[name]()
+        _inject_negate_information(matcher, self.negate)
+        return matcher
+
+    def forget_task(self):
+        if self.task is not None:
+            self.task.remove_done_callback(self._task_done)
+            self.task = None
+
+    def _task_done(self, task):
+        # nothing can reach the context of a finished task, so an
+        # expectation it left behind (its right-hand side raised) is over
+        _namespaces.release(self)
+
+
+def _current_task():
+    '''Returns the asyncio task running in the current thread, if any'''
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is None:
+        return None
+    try:
+        return asyncio.current_task()
+    except (AttributeError, RuntimeError):
+        return None
+
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+if contextvars is not None:
+    # each asyncio task runs in its own context, so tasks suspended between
+    # "lvalue |should|" and the matcher don't see each other's expectations
+    _evaluation_stack = contextvars.ContextVar('should_dsl_evaluations',
+                                               default=())
+
+    def _evaluations():
+        '''Stack (a tuple) of the expectations being evaluated by the
+        current context'''
+        return _evaluation_stack.get()
+
+    def _set_evaluations(evaluations):
+        _evaluation_stack.set(evaluations)
+else:
+    _thread_state = threading.local()
+
+    def _evaluations():
+        '''Stack (a tuple) of the expectations being evaluated by the
+        current thread'''
+        return getattr(_thread_state, 'evaluations', ())
+
+    def _set_evaluations(evaluations):
+        _thread_state.evaluations = evaluations
+
+# CO_COROUTINE, CO_ITERABLE_COROUTINE and CO_ASYNC_GENERATOR
+_COROUTINE_CODE_FLAGS = 0x80 | 0x100 | 0x200
+# the above and CO_GENERATOR
+_SUSPENDABLE_CODE_FLAGS = 0x20 | _COROUTINE_CODE_FLAGS
+
+def _discard_abandoned_evaluations(evaluations, frame):
+    '''Drops the evaluations whose right-hand side raised before reaching
+    the matcher: the ones started by frames that are no longer running and
+    the previous runs of the expression frame is about to evaluate again.
+    Frames of generators and coroutines may just be suspended, so they are
+    only dropped by the latter rule, or once their asyncio task is done'''
+    running = set()
+    current = frame
+    while current is not None:
+        running.add(id(current))
+        current = current.f_back
+    kept = []
+    for evaluation in evaluations:
+        started_by = evaluation.frame
+        if started_by is frame:
+            abandoned = evaluation.lasti == frame.f_lasti
+        else:
+            abandoned = (id(started_by) not in running and
+                         not started_by.f_code.co_flags & _SUSPENDABLE_CODE_FLAGS
+                         or evaluation.task is not None and evaluation.task.done())
+        if abandoned:
+            _namespaces.release(evaluation)
+        else:
+            kept.append(evaluation)
+    return tuple(kept)
+
+def _pop_evaluation(frame):
+    '''Removes and returns the latest evaluation started by frame'''
+    evaluations = _evaluations()
+    index = len(evaluations) - 1
+    while index >= 0 and evaluations[index].frame is not frame:
+        index -= 1
+    if index < 0:
+        # "|should|" was split across frames
+        index = len(evaluations) - 1
+    evaluation = evaluations[index]
+    _set_evaluations(evaluations[:index] + evaluations[index + 1:])
+    return evaluation
+
+
+class _MatcherPlaceholder(object):
+    '''Stands for a matcher name in a module namespace while expectations use
+    it. The matcher is created for the expectation running in the current
+    thread (or asyncio task), so threads sharing a module never share
+    matcher instances. Code not running one of those expectations (another
+    thread calling expect(), for instance) gets what the name was bound to
+    before the placeholder replaced it'''
+
+    def __init__(self, name, key):
+        self._name = name
+        self._key = key
+
+    def __call__(self, *args, **kwargs):
+        evaluation = self._evaluation()
+        if evaluation is None:
+            return self._original()(*args, **kwargs)
+        return _call_matcher(evaluation.create_matcher(self._name), args, kwargs)
+
+    def _materialize(self, evaluation=None):
+        if evaluation is None:
+            evaluation = self._evaluation()
+            if evaluation is None:
+                return _as_matcher(self._original())
+        if self._name not in evaluation.matchers:
+            raise NameError("name %r is not defined" % self._name)
+        return evaluation.create_matcher(self._name)
+
+    def _evaluation(self):
+        for evaluation in reversed(_evaluations()):
+            if self._name in evaluation.matchers:
+                return evaluation
+        return None
+
+    def _original(self):
+        original = _namespaces.original(self._key)
+        if original is _MISSING:
+            if self._name not in should._matchers_by_name:
+                raise NameError("name %r is not defined" % self._name)
+            return MatcherFactory(should._matchers_by_name[self._name])
+        return original
+
+    def __getattr__(self, name):
+        if name in ('_name', '_key'):
+            raise AttributeError(name)
+        return getattr(self._original(), name)
+
+
+_MISSING = object()
+
+
+class _Namespaces(object):
+    '''Puts matcher placeholders on module namespaces, counting how many
+    running expectations use each name. The original identifiers are put back
+    when the last expectation using them finishes'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usages = {}
+        self._placeholders = {}
+
+    def acquire(self, namespace, names):
+        self._lock.acquire()
+        try:
+            for name in names:
+                key = (id(namespace), name)
+                usage = self._usages.get(key)
+                if usage is None:
+                    self._usages[key] = [1, namespace.get(name, _MISSING)]
+                    namespace[name] = self._placeholder(key, name)
+                else:
+                    usage[0] += 1
+        finally:
+            self._lock.release()
+
+    def release(self, evaluation):
+        '''Releases the names of an evaluation once, even if contexts
+        copied from the one that started it try to discard it as well'''
+        self._lock.acquire()
+        try:
+            if evaluation.released:
+                return
+            evaluation.released = True
+            evaluation.forget_task()
+            namespace = evaluation.namespace
+            for name in evaluation.matchers:
+                key = (id(namespace), name)
+                usage = self._usages[key]
+                usage[0] -= 1
+                if usage[0] == 0:
+                    del self._usages[key]
+                    if usage[1] is _MISSING:
+                        namespace.pop(name, None)
+                    else:
+                        namespace[name] = usage[1]
+        finally:
+            self._lock.release()
+
+    def original(self, key):
+        '''Returns what a name was bound to before its placeholder, given
+        its (namespace id, name) key'''
+        usage = self._usages.get(key)
+        if usage is None:
+            return _MISSING
+        return usage[1]
+
+    def _placeholder(self, key, name):
+        try:
+            return self._placeholders[key]
+        except KeyError:
+            placeholder = self._placeholders[key] = _MatcherPlaceholder(name, key)
+            return placeholder
+
+
+_namespaces = _Namespaces()
+
+
+# weak references to the failures whose message is not built yet, by the id
+# of their matcher (which they keep alive)
+_unrendered_failures = {}
+
+def _add_unrendered_failure(failure):
+    key = id(failure.matcher)
+    def discard(reference):
+        if _unrendered_failures.get(key) is reference:
+            _unrendered_failures.pop(key, None)
+    _unrendered_failures[key] = weakref.ref(failure, discard)
+
+def _render_pending_failure(matcher):
+    '''Builds the message of the last failure of a matcher before it runs
+    again, as the message is built from the state the new run overwrites'''
+    reference = _unrendered_failures.pop(id(matcher), None)
+    if reference is not None:
+        failure = reference()
+        if failure is not None:
+            str(failure)
+
+def _inject_negate_information(matcher, negate):
+    if _unrendered_failures:
+        _render_pending_failure(matcher)
+    try:
+        matcher.run_with_negate = negate
+    except AttributeError:
+        pass
+
+def _as_matcher(rvalue):
+    '''Returns a matcher instance for matchers used without being called,
+    such as "[] |should| be_empty" or "expect([]).to(be_empty)"'''
+    if isinstance(rvalue, (_MatcherPlaceholder, MatcherFactory)):
+        return rvalue._materialize()
+    return rvalue
+
+def _call_matcher(matcher, args, kwargs):
+    '''Calls a new matcher with its expected values, keeping them for
+    ShouldNotSatisfied.expected'''
+    matcher = matcher(*args, **kwargs)
+    try:
+        matcher._expected_arguments = args
+    except AttributeError:
+        pass
+    return matcher
+
+def _satisfies(matcher, actual, negate):
+    matcher = _as_matcher(matcher)
+    _inject_negate_information(matcher, negate)
+    return bool(matcher.match(actual)) != negate, matcher
+
+def _check_expectation(matcher, actual, negate):
+    if bool(matcher.match(actual)) == negate:
+        raise ShouldNotSatisfied(matcher=matcher, actual=actual, negate=negate)
+
+def _predicate_matcher_factory(matcher_name, attr_name):
+    return lambda: _PredicateMatcher(attr_name, matcher_name)
+
+
+class _Instrumentation(object):
+    '''Hooks and profiler called around expectations. While there are
+    none, should only checks the active flag'''
+
+    def __init__(self):
+        self.active = False
+        self.profiler = None
+        self.hooks = []
+
+    def _update(self):
+        self.active = self.profiler is not None or bool(self.hooks)
+
+    def before(self, lvalue, negate):
+        for before, after in self.hooks:
+            if before is not None:
+                before(lvalue, negate)
+
+    def check(self, matcher, lvalue, negate, overhead):
+        started = default_timer()
+        passed = bool(matcher.match(lvalue)) != negate
+        match_time = default_timer() - started
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.record(getattr(matcher, 'name', type(matcher).__name__),
+                            type(lvalue), passed, overhead, match_time)
+        for before, after in self.hooks:
+            if after is not None:
+                after(lvalue, matcher, negate, passed)
+        if not passed:
+            raise ShouldNotSatisfied(matcher=matcher, actual=lvalue,
+                                     negate=negate)
+
+_instrumentation = _Instrumentation()
+
+
+class Profiler(object):
+    '''Counts expectations by matcher name and by lvalue type, separating
+    the time should spends finding and creating matchers (dsl time) from
+    the time spent by the matchers themselves (match time)'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # name -> [count, failed, dsl time, match time]
+        self.matchers = {}
+        # type name -> [count, dsl time, match time]
+        self.lvalue_types = {}
+
+    def record(self, matcher_name, lvalue_type, passed, dsl_time, match_time):
+        type_name = getattr(lvalue_type, '__name__', str(lvalue_type))
+        self._lock.acquire()
+        try:
+            stats = self.matchers.get(matcher_name)
+            if stats is None:
+                stats = self.matchers[matcher_name] = [0, 0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += not passed
+            stats[2] += dsl_time
+            stats[3] += match_time
+            stats = self.lvalue_types.get(type_name)
+            if stats is None:
+                stats = self.lvalue_types[type_name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += dsl_time
+            stats[2] += match_time
+        finally:
+            self._lock.release()
+
+    def as_dict(self):
+        matchers = {}
+        for name, (count, failed, dsl_time, match_time) in self.matchers.items():
+            matchers[name] = {'count': count, 'failed': failed,
+                              'dsl_time': dsl_time, 'match_time': match_time}
+        lvalue_types = {}
+        for name, (count, dsl_time, match_time) in self.lvalue_types.items():
+            lvalue_types[name] = {'count': count, 'dsl_time': dsl_time,
+                                  'match_time': match_time}
+        return {'matchers': matchers, 'lvalue_types': lvalue_types}
+
+    def report(self, format='text'):
+        '''Returns the statistics as text (the default) or as JSON, the
+        slowest matchers and lvalue types first'''
+        if format == 'json':
+            import json
+            return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+        if format != 'text':
+            raise ValueError('unknown report format %r' % format)
+        lines = ['%-32s %8s %8s %12s %12s' % ('matcher', 'count', 'failed',
+                                             'dsl time', 'match time')]
+        for name, stats in self._slowest_first(self.matchers, 2):
+            lines.append('%-32s %8d %8d %12.6f %12.6f' % ((name,) + tuple(stats)))
+        lines.append('')
+        lines.append('%-32s %8s %12s %12s' % ('lvalue type', 'count',
+                                              'dsl time', 'match time'))
+        for name, stats in self._slowest_first(self.lvalue_types, 1):
+            lines.append('%-32s %8d %12.6f %12.6f' % ((name,) + tuple(stats)))
+        return '\n'.join(lines)
+
+    def _slowest_first(self, table, first_time):
+        return sorted(table.items(),
+                      key=lambda item: (-sum(item[1][first_time:]), item[0]))
+
+
+MatchCacheInfo = namedtuple('MatchCacheInfo', 'hits misses maxsize currsize')
+
+DEFAULT_CACHE_SIZE = 1024
+
+class _MatchCache(object):
+    '''Least recently used results of a pure function matcher, by actual
+    and expected values. Unhashable values are not cached'''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def result(self, function, actual, expected):
+        # types are part of the key, as 1, 1.0 and True are equal
+        key = (type(actual), actual, type(expected), expected)
+        try:
+            hash(key)
+        except TypeError:
+            return function(actual, expected)
+        self._lock.acquire()
+        try:
+            result = self._results.pop(key, _MISSING)
+            if result is not _MISSING:
+                self._results[key] = result
+                self.hits += 1
+                return result
+            self.misses += 1
+        finally:
+            self._lock.release()
+        result = function(actual, expected)
+        self._lock.acquire()
+        try:
+            self._results[key] = result
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        finally:
+            self._lock.release()
+        return result
+
+    def info(self):
+        return MatchCacheInfo(self.hits, self.misses, self.maxsize,
+                              len(self._results))
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._results.clear()
+            self.hits = self.misses = 0
+        finally:
+            self._lock.release()
+
+
+_match_caches = {}
+
+def _match_cache_for(matcher_function, cache_size):
+    '''Returns the cache of a function matcher, shared by should and
+    should_not'''
+    cache = _match_caches.get(matcher_function)
+    if cache is None or cache.maxsize != cache_size:
+        cache = _match_caches[matcher_function] = _MatchCache(cache_size)
+    return cache
+
+
+_names_by_code = weakref.WeakKeyDictionary()
+
+def _names_used_by(code):
+    '''Returns the global names used by a code object and by the code
+    objects nested in it (lambdas, comprehensions, ...), which are collected
+    once per code object'''
+    try:
+        return _names_by_code[code]
+    except KeyError:
+        names = _names_by_code[code] = _collect_names(code)
+        return names
+    except TypeError:
+        # code objects that can't be weakly referenced
+        return _collect_names(code)
+
+def _collect_names(code):
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, CodeType):
+            names.update(_collect_names(constant))
+    return tuple(names)
+
+
 class Should(object):
 
+    # lets NumPy arrays on the left side fall back to __ror__
+    __array_ufunc__ = None
+
     def __init__(self, negate=False):
         self._negate = negate
         self._matchers_by_name = dict()
-        self._identifiers_named_equal_matchers = dict()
-        self._outer_frame = None
-
-    def _evaluate(self, value):
-        if self._negate:
-            return not value
-        return value
 
     def __ror__(self, lvalue):
-        self._lvalue = lvalue
-        self._create_function_matchers()
+        frame = sys._getframe(1)
+        if _instrumentation.active:
+            _instrumentation.before(lvalue, self._negate)
+            started = default_timer()
+        evaluations = _evaluations()
+        if evaluations:
+            evaluations = _discard_abandoned_evaluations(evaluations, frame)
+        evaluation = _Evaluation(lvalue, self._negate, frame,
+            self._matchers_referenced_by(frame.f_code, lvalue))
+        _namespaces.acquire(evaluation.namespace, evaluation.matchers)
+        _set_evaluations(evaluations + (evaluation,))
+        if _instrumentation.active:
+            evaluation.overhead = default_timer() - started
         return self
 
     def __or__(self, rvalue):
-        self._destroy_function_matchers()
-        self._rvalue = rvalue
-        return self._check_expectation()
-
-    def _check_expectation(self):
-        if not self._evaluate(self._rvalue.match(self._lvalue)):
-            raise ShouldNotSatisfied(self._negate and \
-                self._rvalue.message_for_failed_should_not() or \
-                self._rvalue.message_for_failed_should())
-
-
-    def _destroy_function_matchers(self):
-        self._outer_frame = sys._getframe(2).f_globals
-        self._remove_matchers_from_namespace()
-        self._put_original_identifiers_back()
-
-    def _remove_matchers_from_namespace(self):
-        self._remove_regular_matchers_from_namespace()
-        self._remove_predicate_matchers_from_namespace()
-
-    def _remove_regular_matchers_from_namespace(self):
-        f_globals = self._outer_frame
-        for matcher_name in list(self._matchers_by_name.keys()):
-            del f_globals[matcher_name]
-
-    def _remove_predicate_matchers_from_namespace(self):
-        f_globals = self._outer_frame
-        for attr_name in dir(self._lvalue):
-            matcher = 'be_%s' % attr_name
-            if matcher in f_globals:
-                del f_globals[matcher]
-
-    def _put_original_identifiers_back(self):
-        f_globals = self._outer_frame
-        for attr_name, attr_ref in self._identifiers_named_equal_matchers.items():
-            f_globals[attr_name] = attr_ref
-        self._identifiers_named_equal_matchers.clear()
-
-
-    def _create_function_matchers(self):
-        self._outer_frame = sys._getframe(2).f_globals
-        self._save_clashed_identifiers()
-        self._put_matchers_on_namespace()
-
-    def _save_clashed_identifiers(self):
-        f_globals = self._outer_frame
-        predicate_matcher_names = ['be_' + attr_name for attr_name in dir(self._lvalue) if not attr_name.startswith('_')]
-        for matcher_name in list(self._matchers_by_name.keys()) + predicate_matcher_names:
-            if matcher_name in f_globals:
-                self._identifiers_named_equal_matchers[matcher_name] = f_globals[matcher_name]
-
-    def _put_matchers_on_namespace(self):
-        self._put_regular_matchers_on_namespace()
-        self._put_predicate_matchers_on_namespace()
-
-    def _put_regular_matchers_on_namespace(self):
-        f_globals = self._outer_frame
-        for matcher_name, matcher_function in self._matchers_by_name.items():
-            matcher_function = self._matchers_by_name[matcher_name]
-            matcher = matcher_function()
-            self._inject_negate_information(matcher)
-            f_globals[matcher_name] = matcher
-
-    def _inject_negate_information(self, matcher):
-        try:
-            matcher.run_with_negate = self._negate
-        except AttributeError:
-            pass
-
-    def _put_predicate_matchers_on_namespace(self):
-        f_globals = self._outer_frame
-        predicate_and_matcher_names = []
-        public_names = self._get_all_public_attr_names(self._lvalue)
-        for attr_name in public_names:
-            for regex in _predicate_regexes:
-                r = re.match(regex, attr_name)
-                if r:
-                    predicate_and_matcher_names.append((r.group(1), attr_name))
-        predicate_and_matcher_names += [(attr_name, attr_name) for attr_name in public_names]
-        for predicate_name, attr_name in predicate_and_matcher_names:
-            f_globals['be_' + predicate_name] = _PredicateMatcher(attr_name)
-
-
-    def add_matcher(self, matcher_object):
-        if (hasattr(matcher_object, 'func_name') or
-            isinstance(matcher_object, FunctionType)):
-            function, message, not_for_should, not_for_should_not = \
-                self._process_custom_matcher_function(matcher_object)
-            class GeneratedMatcher(object):
-                name = matcher_object.__name__
-                def __init__(self):
-                    self._function, self._message = function, message
-                def __call__(self, arg):
-                    self._arg = arg
-                    return self
-                def match(self, value):
-                    self._value = value
-                    return self._function(self._value, self._arg)
-                def message_for_failed_should(self):
-                    return self._build_message(not_for_should)
-                def message_for_failed_should_not(self):
-                    return self._build_message(not_for_should_not)
-                def _build_message(self, not_):
-                    try:
-                        return self._message % (self._value, not_, self._arg)
-                    except TypeError:
-                        return self._message % {
-                            'expected': self._arg,
-                            'not': not_,
-                            'actual': self._value}
-
-            matcher_object = GeneratedMatcher
-            name = GeneratedMatcher.name
+        evaluation = _pop_evaluation(sys._getframe(1))
+        if evaluation.overhead is not None:
+            started = default_timer()
+        evaluation.frame = None
+        _namespaces.release(evaluation)
+        if isinstance(rvalue, _MatcherPlaceholder):
+            rvalue = rvalue._materialize(evaluation)
         else:
-            name = matcher_object.name
-        self._ensure_matcher_init_doesnt_have_arguments(matcher_object)
-        self._matchers_by_name[name] = matcher_object
+            rvalue = _as_matcher(rvalue)
+            if _unrendered_failures:
+                _render_pending_failure(rvalue)
+        if evaluation.overhead is not None:
+            overhead = evaluation.overhead + default_timer() - started
+            return _instrumentation.check(rvalue, evaluation.lvalue,
+                                          self._negate, overhead)
+        return _check_expectation(rvalue, evaluation.lvalue, self._negate)
 
-    def _ensure_matcher_init_doesnt_have_arguments(self, matcher_object):
-        try:
-            matcher_object()
-        except TypeError:
-            e = sys.exc_info()[1]
-            if str(e).startswith('__init__() takes exactly'):
-                raise TypeError('matcher class constructor cannot have arguments')
-            else:
-                raise
+    def _matchers_referenced_by(self, code, lvalue):
+        '''Returns {name: matcher factory} for the regular and predicate
+        matchers whose names are used by the given code object'''
+        referenced_names = _names_used_by(code)
+        matchers = {}
+        for name in referenced_names:
+            if name in self._matchers_by_name:
+                matchers[name] = self._matchers_by_name[name]
+        predicate_table = _predicate_matcher_names.resolve(lvalue,
+            [name for name in referenced_names if name.startswith('be_')])
+        for matcher_name, attr_name in predicate_table.items():
+            matchers[matcher_name] = _predicate_matcher_factory(matcher_name,
+                                                                attr_name)
+        return matchers
 
-    def _get_all_public_attr_names(self, obj):
-        return [attr_name for attr_name in dir(obj) if not attr_name.startswith('_')]
 
-    def _process_custom_matcher_function(self, matcher_function):
-        values = matcher_function()
-        function, message = values[0:2]
-        if len(values) <= 2:
-            nots = ('not ', '')
+    def add_matcher(self, matcher_object, pure=False,
+                    cache_size=DEFAULT_CACHE_SIZE):
+        '''Registers a matcher class or function. Neither is called here:
+        function matchers are configured when first used'''
+        if _is_matcher_function(matcher_object):
+            cache = None
+            if pure:
+                cache = _match_cache_for(matcher_object, cache_size)
+            matcher_object = _FunctionMatcherClass(matcher_object, cache)
+        elif pure:
+            raise TypeError('only function matchers can be pure')
         else:
-            nots = values[2]._negate and ('', 'not ') or ('not ', '')
-        return (function, message) + nots
+            self._ensure_matcher_init_doesnt_have_arguments(matcher_object)
+        self._matchers_by_name[matcher_object.name] = matcher_object
+
+    def _ensure_matcher_init_doesnt_have_arguments(self, matcher_object):
+        # checks the signature, since creating a matcher can be expensive
+        init = getattr(matcher_object, '__init__', None)
+        init = getattr(init, '__func__', init)
+        code = getattr(init, '__code__', getattr(init, 'func_code', None))
+        if code is None:
+            return
+        defaults = getattr(init, '__defaults__', None) or ()
+        if code.co_argcount - len(defaults) > 1:
+            raise TypeError('matcher class constructor cannot have arguments')
 
     def add_aliases(self, **aliases):
         for name, alias in aliases.items():
@@ -171,10 +745,87 @@ class Should(object):
             self._matchers_by_name[alias] = matcher
 
 
+class _FunctionMatcherClass(object):
+    '''Creates the matchers of a function registered through matcher(). It
+    is pickled by name, so function matchers can be sent to other processes
+    as long as their module can be imported there'''
+
+    def __init__(self, matcher_function, cache=None):
+        self.cache = cache
+        self.name = matcher_function.__name__
+        self.module = matcher_function.__module__
+        self.matcher_function = matcher_function
+        self._configured = False
+
+    def __call__(self):
+        if not self._configured:
+            self._configure()
+        return _FunctionMatcher(self)
+
+    def _configure(self):
+        values = self.matcher_function()
+        self.function, self.message = values[0:2]
+        if len(values) <= 2 or not values[2]._negate:
+            self.not_for_should, self.not_for_should_not = 'not ', ''
+        else:
+            self.not_for_should, self.not_for_should_not = '', 'not '
+        self._configured = True
+
+    def __reduce__(self):
+        return (_registered_function_matcher_class, (self.module, self.name))
+
+
+def _registered_function_matcher_class(module, name):
+    __import__(module)
+    return should._matchers_by_name[name]
+
+
+class _FunctionMatcher(object):
+
+    def __init__(self, matcher_class):
+        self._matcher_class = matcher_class
+        self.name = matcher_class.name
+
+    def __call__(self, arg):
+        self._arg = arg
+        return self
+
+    def match(self, value):
+        self._value = value
+        matcher_class = self._matcher_class
+        if matcher_class.cache is None:
+            return matcher_class.function(value, self._arg)
+        return matcher_class.cache.result(matcher_class.function, value,
+                                          self._arg)
+
+    def match_elements(self, values):
+        function = self._matcher_class.function
+        if getattr(function, 'elementwise', False):
+            return function(values, self._arg)
+
+    def message_for_failed_should(self):
+        return self._build_message(self._matcher_class.not_for_should)
+
+    def message_for_failed_should_not(self):
+        return self._build_message(self._matcher_class.not_for_should_not)
+
+    def _build_message(self, not_):
+        value, arg = bounded(self._value), bounded(self._arg)
+        message = self._matcher_class.message
+        try:
+            return message % (value, not_, arg)
+        except TypeError:
+            return message % {
+                'expected': arg,
+                'not': not_,
+                'actual': value}
+
+
 class _PredicateMatcher(object):
 
-    def __init__(self, attr_name):
+    def __init__(self, attr_name, name=None):
         self._attr_name = attr_name
+        self.name = name or 'be_' + attr_name
 
     def __call__(self, *params):
         self._params = params
@@ -206,7 +857,7 @@ class _PredicateMatcher(object):
     def _display_attr(self, attr_name):
         if self._is_method(getattr(self._value, attr_name)):
             if self._has_param():
-                repr_params = [repr(param) for param in self._params]
+                repr_params = [bounded_repr(param) for param in self._params]
                 param = ", ".join(repr_params)
             else:
                 param = ""
@@ -222,25 +873,288 @@ class _PredicateMatcher(object):
         return hasattr(self, '_params')
 
 
+def _safe_repr(value):
+    '''bounded_repr, falling back to the type name when repr() raises'''
+    try:
+        return bounded_repr(value)
+    except Exception:
+        return '<%s object>' % type(value).__name__
+
+
 class ShouldNotSatisfied(AssertionError):
-    '''Extends AssertionError for unittest compatibility'''
+    '''Extends AssertionError for unittest compatibility.
+
+    When raised by an expectation, it carries the matcher, the actual value,
+    the expected value and whether the expectation was negated (should_not).
+    The message is only built when the exception is turned into a string or
+    its args are read, or before its matcher runs again.
+    '''
+
+    def __init__(self, message=None, matcher=None, actual=None, negate=False):
+        if message is None:
+            AssertionError.__init__(self)
+        else:
+            AssertionError.__init__(self, message)
+        self._message = message
+        self.matcher = matcher
+        self.actual = actual
+        self.negate = negate
+        if message is None and matcher is not None:
+            _add_unrendered_failure(self)
+
+    def _get_expected(self):
+        # read from __dict__: matchers like have answer any attribute
+        arguments = getattr(self.matcher, '__dict__', {}).get('_expected_arguments')
+        if not arguments:
+            return None
+        if len(arguments) == 1:
+            return arguments[0]
+        return arguments
+    expected = property(_get_expected)
+
+    def _get_args(self):
+        self._render()
+        return AssertionError.args.__get__(self)
+    def _set_args(self, args):
+        AssertionError.args.__set__(self, args)
+    args = property(_get_args, _set_args)
+
+    def __str__(self):
+        self._render()
+        return AssertionError.__str__(self)
+
+    def __repr__(self):
+        self._render()
+        return AssertionError.__repr__(self)
+
+    def _render(self):
+        if self._message is None and self.matcher is not None:
+            self._message = self._build_message()
+            AssertionError.args.__set__(self, (self._message,))
+
+    def _build_message(self):
+        try:
+            if self.negate:
+                return self.matcher.message_for_failed_should_not()
+            return self.matcher.message_for_failed_should()
+        except Exception:
+            error = sys.exc_info()[1]
+            return ('expected %s %sto match %s, but building the failure '
+                    'message raised %s: %s') % (
+                _safe_repr(self.actual), self.negate and 'not ' or '',
+                getattr(self.matcher, 'name', type(self.matcher).__name__),
+                type(error).__name__, bounded_str(error))
+
+    def __reduce__(self):
+        # matchers may hold unpicklable values, so only the message travels
+        return (ShouldNotSatisfied, (str(self),))
+
+
+class MatcherFactory(object):
+    '''Creates a new matcher each time it is called, so matchers can be
+    imported from should_dsl.matchers and used without should/should_not:
+
+        expect(1).to(equal_to(1))
+    '''
+
+    def __init__(self, matcher_class):
+        self._matcher_class = matcher_class
+        self.__name__ = matcher_class.name
+
+    def __call__(self, *args, **kwargs):
+        return _call_matcher(self._materialize(), args, kwargs)
+
+    def _materialize(self):
+        return self._matcher_class()
+
+    def __reduce__(self):
+        return (MatcherFactory, (self._matcher_class,))
+
+    def __repr__(self):
+        return '<matcher %s>' % self.__name__
+
+
+class _FunctionMatcherFactory(MatcherFactory):
+    '''Factory returned by matcher() for function matchers. Called without
+    arguments, it still returns the matcher configuration, as the decorated
+    function did'''
+
+    def __init__(self, function, matcher_class):
+        MatcherFactory.__init__(self, matcher_class)
+        self._function = function
+        self.__doc__ = function.__doc__
+        self.__module__ = function.__module__
+
+    def __call__(self, *args, **kwargs):
+        if not args and not kwargs:
+            return self._function()
+        return MatcherFactory.__call__(self, *args, **kwargs)
+
+    def cache_info(self):
+        '''Returns the hits, misses, maximum and current size of the results
+        cache of a pure matcher, or None for other matchers'''
+        cache = self._matcher_class.cache
+        return cache and cache.info()
+
+    def cache_clear(self):
+        if self._matcher_class.cache is not None:
+            self._matcher_class.cache.clear()
+
+    def __reduce__(self):
+        return (_function_matcher_factory, (self._matcher_class,))
+
+
+def _function_matcher_factory(matcher_class):
+    return _FunctionMatcherFactory(matcher_class.matcher_function,
+                                   matcher_class)
+
+
+class Expectation(object):
+    '''Frame-free alternative to should and should_not:
+
+        expect(actual).to(matcher)
+        expect(actual).not_to(matcher)
+
+    It neither inspects the caller's frame nor touches its namespace'''
+
+    def __init__(self, actual):
+        self._actual = actual
+
+    def to(self, matcher):
+        self._check(matcher, False)
+
+    def not_to(self, matcher):
+        self._check(matcher, True)
+
+    def _check(self, matcher, negate):
+        if _instrumentation.active:
+            _instrumentation.before(self._actual, negate)
+            started = default_timer()
+            matcher = _as_matcher(matcher)
+            _inject_negate_information(matcher, negate)
+            _instrumentation.check(matcher, self._actual, negate,
+                                   default_timer() - started)
+        else:
+            matcher = _as_matcher(matcher)
+            _inject_negate_information(matcher, negate)
+            _check_expectation(matcher, self._actual, negate)
+
+
+class MatchResult(object):
+    '''Outcome of evaluate(). It is true when the expectation is satisfied.
+    The reason is the failure message, built only when asked for (or before
+    the matcher runs again)'''
+
+    def __init__(self, satisfied, matcher, actual, negate):
+        self.satisfied = satisfied
+        self.matcher = matcher
+        self.actual = actual
+        self.negate = negate
+        self._failure = None
+        if not satisfied:
+            self._failure = ShouldNotSatisfied(matcher=matcher, actual=actual,
+                                               negate=negate)
+
+    def __bool__(self):
+        return self.satisfied
+    __nonzero__ = __bool__
+
+    def _get_reason(self):
+        if self.satisfied:
+            return None
+        return str(self.failure())
+    reason = property(_get_reason)
+
+    def failure(self):
+        '''Returns the ShouldNotSatisfied that should or should_not would
+        raise, or None if the expectation is satisfied'''
+        return self._failure
+
+    def __repr__(self):
+        if self.satisfied:
+            return '<MatchResult satisfied>'
+        return '<MatchResult failed: %s>' % self.reason
 
 
 should = Should(negate=False)
 should_not = Should(negate=True)
 
-def matcher(matcher_object):
-    '''Adds given matcher to should objects. We recommend you use it as a decorator'''
-    should.add_matcher(matcher_object)
-    should_not.add_matcher(matcher_object)
+def expect(actual):
+    return Expectation(actual)
+
+def matches(actual, matcher):
+    '''Returns whether "actual |should| matcher" would pass, without raising
+    or building failure messages'''
+    return _satisfies(matcher, actual, False)[0]
+
+def fails(actual, matcher):
+    '''Returns whether "actual |should| matcher" would fail, without raising
+    or building failure messages'''
+    return not _satisfies(matcher, actual, False)[0]
+
+def evaluate(actual, matcher, negate=False):
+    '''Evaluates "actual |should| matcher" (or should_not, if negate is
+    true) and returns a MatchResult, whose reason is built on demand'''
+    satisfied, matcher = _satisfies(matcher, actual, negate)
+    return MatchResult(satisfied, matcher, actual, negate)
+
+def _is_matcher_function(matcher_object):
+    return (hasattr(matcher_object, 'func_name') or
+            isinstance(matcher_object, FunctionType))
+
+def matcher(matcher_object=None, pure=False, cache_size=DEFAULT_CACHE_SIZE):
+    '''Adds given matcher to should objects. We recommend you use it as a decorator.
+
+    Function matchers whose verifiers only depend on the actual and expected
+    values can be decorated with @matcher(pure=True), so their results are
+    kept in a cache of the cache_size most recently used values'''
+    if matcher_object is None:
+        return lambda matcher_object: matcher(matcher_object, pure, cache_size)
+    should.add_matcher(matcher_object, pure, cache_size)
+    should_not.add_matcher(matcher_object, pure, cache_size)
+    if _is_matcher_function(matcher_object):
+        return _FunctionMatcherFactory(matcher_object,
+            should._matchers_by_name[matcher_object.__name__])
     return matcher_object
 
 def add_predicate_regex(regex):
-    _predicate_regexes.update([regex])
+    if regex not in _predicate_regexes:
+        _predicate_regexes.update([regex])
+        _predicate_matcher_names.clear()
 
 def matcher_configuration(verifier, message, word_not_for=should_not):
     return (verifier, message, word_not_for)
 
+def enable_profiling(profiler=None):
+    '''Starts recording expectations in the given profiler (or in a new
+    one), which is returned'''
+    if profiler is None:
+        profiler = Profiler()
+    _instrumentation.profiler = profiler
+    _instrumentation._update()
+    return profiler
+
+def disable_profiling():
+    '''Stops recording expectations, returning the profiler used'''
+    profiler = _instrumentation.profiler
+    _instrumentation.profiler = None
+    _instrumentation._update()
+    return profiler
+
+def add_hooks(before=None, after=None):
+    '''Adds functions called around each expectation: before(lvalue, negate)
+    when it starts and after(lvalue, matcher, negate, passed) after its
+    matcher runs. Returns a handle for remove_hooks'''
+    hooks = (before, after)
+    _instrumentation.hooks = _instrumentation.hooks + [hooks]
+    _instrumentation._update()
+    return hooks
+
+def remove_hooks(hooks):
+    _instrumentation.hooks = [h for h in _instrumentation.hooks
+                              if h is not hooks]
+    _instrumentation._update()
+
 def aliases(**kwargs):
     should.add_aliases(**kwargs)
     should_not.add_aliases(**kwargs)
@@ -1,10 +1,16 @@
 import re
 import sys
-import copy
-from decimal import Decimal
-from difflib import unified_diff
+import numbers
+import operator
+from collections import deque
+from functools import partial
+from itertools import islice
+from timeit import default_timer
 from should_dsl import matcher
-from should_dsl.backwardscompat import string_types
+from should_dsl.dsl import (MatcherFactory, _as_matcher,
+                            _inject_negate_information)
+from should_dsl.backwardscompat import string_types, Mapping
+from should_dsl.reprs import bounded, bounded_repr, humanize_elements
 
 
 class Be(object):
@@ -20,59 +26,94 @@ class Be(object):
         return self._actual is self._expected
 
     def message_for_failed_should(self):
-        return "%r was expected to be %r" % (self._actual, self._expected)
+        return "%r was expected to be %r" % (bounded(self._actual), bounded(self._expected))
 
     def message_for_failed_should_not(self):
-        return "%r was not expected to be %r" % (self._actual, self._expected)
+        return "%r was not expected to be %r" % (bounded(self._actual), bounded(self._expected))
 
 
 matcher(Be)
+be = MatcherFactory(Be)
 
 
 class EqualTo(object):
 
     name = 'equal_to'
 
-    def __call__(self, expected, diff=False, case_sensitive=True):
+    def __call__(self, expected, diff=False, case_sensitive=True,
+                 diff_context=3, max_diff_lines=1000):
         self._expected = expected
         self._make_diff = diff
         self._case_sensitive = case_sensitive
+        self._diff_context = diff_context
+        self._max_diff_lines = max_diff_lines
         return self
 
     def match(self, actual):
         self._actual = actual
-        self._diff = ''
 
         if not self._case_sensitive:
             self._prepare_strings_to_case_insensitive()
 
-        if not self._actual == self._expected:
-            if isinstance(self._expected, string_types) and isinstance(self._actual, string_types) and self._make_diff:
-                self._prepare_strings_to_diff()
-                diff_generator = unified_diff(self._actual, self._expected, fromfile='actual', tofile='expected')
-                for line in diff_generator:
-                    self._diff += line
-            return False
-        return True
+        return self._actual == self._expected
 
     def _prepare_strings_to_case_insensitive(self):
             self._expected = self._expected.lower()
             self._actual = self._actual.lower()
 
-    def _prepare_strings_to_diff(self):
-            self._actual = self._actual.splitlines(True)
-            self._expected = self._expected.splitlines(True)
+    def _diff(self):
+        '''Builds the diff only when a failure message needs it, leaving out
+        the unchanged lines around the differences and stopping after
+        max_diff_lines lines'''
+        from difflib import unified_diff
+        actual = self._actual.splitlines(True)
+        expected = self._expected.splitlines(True)
+        head = self._common_lines(actual, expected)
+        tail = self._common_lines(actual[head:][::-1], expected[head:][::-1])
+        start = max(head - self._diff_context, 0)
+        skipped_tail = max(tail - self._diff_context, 0)
+        lines = unified_diff(actual[start:len(actual) - skipped_tail],
+                             expected[start:len(expected) - skipped_tail],
+                             fromfile='actual', tofile='expected',
+                             n=self._diff_context)
+        if self._max_diff_lines is not None:
+            lines = list(islice(lines, self._max_diff_lines + 1))
+            if len(lines) > self._max_diff_lines:
+                lines = lines[:self._max_diff_lines]
+                lines.append('\n(diff truncated after %d lines)' % self._max_diff_lines)
+        return ''.join([self._shift_hunk_header(line, start) for line in lines])
+
+    def _common_lines(self, actual, expected):
+        count = 0
+        for actual_line, expected_line in zip(actual, expected):
+            if actual_line != expected_line:
+                break
+            count += 1
+        return count
+
+    _hunk_header = re.compile(r'^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@')
+
+    def _shift_hunk_header(self, line, offset):
+        if not offset or not line.startswith('@@'):
+            return line
+        return self._hunk_header.sub(lambda m: '@@ -%d%s +%d%s @@' % (
+            int(m.group(1)) + offset, m.group(2) or '',
+            int(m.group(3)) + offset, m.group(4) or ''), line)
+
+    def _can_diff(self):
+        return (self._make_diff and isinstance(self._expected, string_types) and
+                isinstance(self._actual, string_types))
 
     def message_for_failed_should(self):
-        default_message = "%r is not equal to %r" % (self._actual, self._expected)
-        if not self._make_diff:
-            return default_message
-        return "the strings are different, see the diff below:\n%s" % self._diff
+        if not self._can_diff():
+            return "%r is not equal to %r" % (bounded(self._actual), bounded(self._expected))
+        return "the strings are different, see the diff below:\n%s" % self._diff()
 
     def message_for_failed_should_not(self):
-        return "%r is equal to %r" % (self._actual, self._expected)
+        return "%r is equal to %r" % (bounded(self._actual), bounded(self._expected))
 
 matcher(EqualTo)
+equal_to = MatcherFactory(EqualTo)
 
 
 @matcher
@@ -90,34 +131,42 @@ def be_into():
     return (lambda item, container: item in container, '%r is %sinto %r')
 
 
+def elementwise(verifier):
+    '''Marks a function matcher verifier as also working element by element
+    on NumPy arrays, returning an array of booleans'''
+    verifier.elementwise = True
+    return verifier
+
+
 @matcher
 def be_greater_than():
-    return (lambda x, y: x > y, '%r is %sgreater than %r')
+    return (elementwise(lambda x, y: x > y), '%r is %sgreater than %r')
 
 
 @matcher
 def be_greater_than_or_equal_to():
-    return (lambda x, y: x >= y, '%r is %sgreater than or equal to %r')
+    return (elementwise(lambda x, y: x >= y), '%r is %sgreater than or equal to %r')
 
 
 @matcher
 def be_less_than():
-    return (lambda x, y: x < y, '%r is %sless than %r')
+    return (elementwise(lambda x, y: x < y), '%r is %sless than %r')
 
 
 @matcher
 def be_less_than_or_equal_to():
-    return (lambda x, y: x <= y, '%r is %sless than or equal to %r')
+    return (elementwise(lambda x, y: x <= y), '%r is %sless than or equal to %r')
 
 
-def check_exception(expected_exception, callable_and_possible_params):
+def _function_and_args(callable_and_possible_params):
+    '''Splits (function, arg1, arg2, ...) into the function and its
+    arguments. A callable alone has no arguments'''
     if getattr(callable_and_possible_params, '__getitem__', False):
-        callable_object = callable_and_possible_params[0]
-        params = callable_and_possible_params[1:]
-    else:
-        callable_object = callable_and_possible_params
-        params = []
+        return callable_and_possible_params[0], callable_and_possible_params[1:]
+    return callable_and_possible_params, []
 
+def check_exception(expected_exception, callable_and_possible_params):
+    callable_object, params = _function_and_args(callable_and_possible_params)
     try:
         callable_object(*params)
         return False
@@ -149,24 +198,27 @@ class Throw:
 
     def match(self, lvalue):
         self._lvalue = lvalue
-        if getattr(lvalue, '__getitem__', False):
-            args = lvalue[1:]
-            lvalue = lvalue[0]
-        else:
-            args = []
+        function, args = _function_and_args(lvalue)
         try:
-            lvalue(*args)
-            self._actual_exception = None
-            return False
+            function(*args)
         except self._expected_exception:
-            e = sys.exc_info()[1]
-            self._actual_exception = self._expected_exception
-            self._actual_message = str(e)
-            return self._handle_expected_message() and self._handle_expected_regex()
+            return self._expected_exception_thrown(sys.exc_info()[1])
         except Exception:
-            e = sys.exc_info()[1]
-            self._actual_exception = e.__class__
-            return False
+            return self._other_exception_thrown(sys.exc_info()[1])
+        return self._no_exception_thrown()
+
+    def _expected_exception_thrown(self, exception):
+        self._actual_exception = self._expected_exception
+        self._actual_message = str(exception)
+        return self._handle_expected_message() and self._handle_expected_regex()
+
+    def _other_exception_thrown(self, exception):
+        self._actual_exception = exception.__class__
+        return False
+
+    def _no_exception_thrown(self):
+        self._actual_exception = None
+        return False
 
     def _using_message(self):
         return self._expected_message is not None
@@ -190,15 +242,15 @@ class Throw:
     def message_for_failed_should(self):
         message = "expected to throw %r" % self._expected_exception.__name__
         if self._using_message():
-            message += " with the message %r" % self._expected_message
+            message += " with the message %r" % bounded(self._expected_message)
         elif self._using_regex():
-            message += " with a message that matches %r" % self._expected_message_regex
+            message += " with a message that matches %r" % bounded(self._expected_message_regex)
         if self._got_exception():
             message += ', got %r' % self._actual_exception.__name__
             if self._using_message():
-                message += ' with %r' % self._actual_message
+                message += ' with %r' % bounded(self._actual_message)
             elif self._using_regex():
-                message += ' with no match for %r' % self._actual_message
+                message += ' with no match for %r' % bounded(self._actual_message)
         else:
             message += ', got no exception'
         return message
@@ -206,27 +258,77 @@ class Throw:
     def message_for_failed_should_not(self):
         message = "expected not to throw %r" % self._expected_exception.__name__
         if self._using_message():
-            message += " with the message %r" % self._expected_message
+            message += " with the message %r" % bounded(self._expected_message)
         elif self._using_regex():
-            message += " with a message that matches %r" % self._expected_message_regex
+            message += " with a message that matches %r" % bounded(self._expected_message_regex)
         return "%s, but got it" % message
 
 matcher(Throw)
+throw = MatcherFactory(Throw)
 
 
-@matcher
-def include_in_any_order():
-    def contains_in_any_order(container, elements):
-        for element in elements:
-            if element not in container:
-                return False
-        return True
-    return (contains_in_any_order, "%r does %sinclude in any order %r")
+class ElementIndex(object):
+    '''Set of the items of a collection, for "in" tests that do not scan it.
+    Unhashable items are kept aside and searched linearly'''
 
+    def __init__(self, items):
+        self._items = items
+        self._hashable, self._unhashable = set(), []
+        for item in items:
+            try:
+                self._hashable.add(item)
+            except TypeError:
+                self._unhashable.append(item)
 
-@matcher
-def include_all_of():
-    return (include_in_any_order()[0], "%r does %sinclude all of %r")
+    def __contains__(self, element):
+        try:
+            return element in self._hashable or element in self._unhashable
+        except TypeError:
+            return element in self._items
+
+
+def missing_elements(container, elements):
+    '''Returns the elements that are not in container. Lists and tuples are
+    indexed once, instead of being scanned for each element'''
+    if len(elements) >= 4 and getattr(type(container), '__contains__', None) in (
+            list.__contains__, tuple.__contains__, deque.__contains__):
+        container = ElementIndex(container)
+    return [element for element in elements if element not in container]
+
+
+class IncludeInAnyOrder(object):
+
+    name = 'include_in_any_order'
+    description = 'include in any order'
+
+    def __call__(self, elements):
+        self._elements = elements
+        return self
+
+    def match(self, container):
+        self._container = container
+        self._missing = missing_elements(container, list(self._elements))
+        return not self._missing
+
+    def message_for_failed_should(self):
+        return "%r does not %s %r, missing %s" % (bounded(self._container),
+            self.description, bounded(self._elements), humanize_elements(self._missing))
+
+    def message_for_failed_should_not(self):
+        return "%r does %s %r" % (bounded(self._container), self.description,
+            bounded(self._elements))
+
+matcher(IncludeInAnyOrder)
+include_in_any_order = MatcherFactory(IncludeInAnyOrder)
+
+
+class IncludeAllOf(IncludeInAnyOrder):
+
+    name = 'include_all_of'
+    description = 'include all of'
+
+matcher(IncludeAllOf)
+include_all_of = MatcherFactory(IncludeAllOf)
 
 
 @matcher
@@ -273,15 +375,16 @@ class BeLike(object):
         return re.match(self._regex, self._lvalue, self._flags) is not None
 
     def message_for_failed_should(self):
-        return "%r is not like %r%s" % (self._lvalue, self._regex,
+        return "%r is not like %r%s" % (bounded(self._lvalue), self._regex,
             self._flags and ' with given flags' or '')
 
     def message_for_failed_should_not(self):
-        return "%r is like %r%s" % (self._lvalue, self._regex,
+        return "%r is like %r%s" % (bounded(self._lvalue), self._regex,
             self._flags and ' with given flags' or '')
 
 
 matcher(BeLike)
+be_like = MatcherFactory(BeLike)
 
 
 @matcher
@@ -304,6 +407,8 @@ class Have(object):
         return self
 
     def __getattr__(self, collection_name):
+        if collection_name.startswith('__'):
+            raise AttributeError(collection_name)
         self._collection_name = collection_name
         self._humanized_collection_name = collection_name.replace('_', ' ')
         return self
@@ -373,6 +478,7 @@ class Have(object):
         return hasattr(objekt, '__len__')
 
 matcher(Have)
+have = MatcherFactory(Have)
 
 
 class HaveAtLeast(Have):
@@ -384,6 +490,7 @@ class HaveAtLeast(Have):
 
 
 matcher(HaveAtLeast)
+have_at_least = MatcherFactory(HaveAtLeast)
 
 
 class HaveAtMost(Have):
@@ -394,6 +501,7 @@ class HaveAtMost(Have):
         return len(self._collection) <= self._count
 
 matcher(HaveAtMost)
+have_at_most = MatcherFactory(HaveAtMost)
 
 
 class RespondTo(object):
@@ -409,37 +517,146 @@ class RespondTo(object):
         return hasattr(self._lvalue, self._method_name)
 
     def message_for_failed_should(self):
-        return "expected %r to respond to %r" % (self._lvalue,
+        return "expected %r to respond to %r" % (bounded(self._lvalue),
             self._method_name)
 
     def message_for_failed_should_not(self):
-        return "expected %r not to respond to %r" % (self._lvalue,
+        return "expected %r not to respond to %r" % (bounded(self._lvalue),
             self._method_name)
 
 matcher(RespondTo)
+respond_to = MatcherFactory(RespondTo)
 
 
 class CloseTo(object):
 
     name = 'close_to'
 
-    def __call__(self, expected, delta):
+    # relative rounding error allowed to the float fast path; differences
+    # within it of the delta are decided by the exact decimal comparison
+    _float_margin = 4 * sys.float_info.epsilon
+
+    def __call__(self, expected, delta, exact=False):
         self._expected, self._delta = expected, delta
+        self._exact = exact
         return self
 
     def match(self, actual):
         self._actual = actual
-        return abs(Decimal(str(self._actual)) - Decimal(str(self._expected))) <= Decimal(str(self._delta))
+        self._violations = None
+        numpy = sys.modules.get('numpy')
+        if numpy is not None and [value for value in (actual, self._expected, self._delta)
+                                  if isinstance(value, numpy.ndarray)]:
+            return self._match_array(numpy)
+        if self._is_sequence(actual):
+            return self._match_sequence()
+        return self._is_close(actual, self._expected, self._delta)
+
+    def _is_close(self, actual, expected, delta):
+        if not self._exact and self._is_real(actual) and \
+                self._is_real(expected) and self._is_real(delta):
+            difference = abs(actual - expected)
+            if difference != difference:
+                return False
+            margin = self._float_margin * (abs(actual) + abs(expected) + abs(delta))
+            if difference < delta - margin:
+                return True
+            if difference > delta + margin:
+                return False
+        return self._is_close_exactly(actual, expected, delta)
+
+    def _is_close_exactly(self, actual, expected, delta):
+        from decimal import Decimal
+        return abs(Decimal(str(actual)) - Decimal(str(expected))) <= Decimal(str(delta))
+
+    def _is_real(self, value):
+        return type(value) in (int, float) or isinstance(value, numbers.Real)
+
+    def _is_sequence(self, value):
+        return (not isinstance(value, string_types) and
+                hasattr(value, '__len__') and hasattr(value, '__iter__'))
+
+    def _match_sequence(self):
+        actual = list(self._actual)
+        if self._is_sequence(self._expected):
+            expected = list(self._expected)
+            if len(expected) != len(actual):
+                raise TypeError('close_to cannot compare %d elements to %d' % (
+                    len(actual), len(expected)))
+        else:
+            expected = [self._expected] * len(actual)
+        outside = [index for index in range(len(actual))
+                   if not self._is_close(actual[index], expected[index], self._delta)]
+        if outside:
+            differences = [abs(actual[index] - expected[index]) for index in outside]
+            worst = outside[differences.index(max(differences))]
+            self._violations = (len(outside), len(actual), worst, actual[worst],
+                                max(differences))
+        else:
+            self._violations = (0, len(actual), None, None, None)
+        return not outside
+
+    def match_elements(self, values):
+        '''Returns a mask of the values (a NumPy array) close to the
+        expected value, so each checks arrays in a vectorized way'''
+        return ~self._compare_arrays(sys.modules['numpy'], values)[0]
+
+    def _compare_arrays(self, numpy, actual):
+        actual = numpy.asarray(actual, dtype=float)
+        expected = numpy.asarray(self._expected, dtype=float)
+        delta = numpy.asarray(self._delta, dtype=float)
+        actual, expected, delta = numpy.broadcast_arrays(actual, expected, delta)
+        difference = numpy.abs(actual - expected)
+        excess = difference - delta
+        if self._exact:
+            outside = numpy.zeros(actual.shape, dtype=bool)
+            undecided = numpy.ones(actual.shape, dtype=bool)
+        else:
+            margin = self._float_margin * (numpy.abs(actual) + numpy.abs(expected) +
+                                           numpy.abs(delta))
+            outside = (excess > margin) | numpy.isnan(difference)
+            undecided = numpy.abs(excess) <= margin
+        for index in zip(*numpy.nonzero(undecided)):
+            if not self._is_close_exactly(actual[index], expected[index], delta[index]):
+                outside[index] = True
+        return outside, actual, difference, excess
+
+    def _match_array(self, numpy):
+        outside, actual, difference, excess = self._compare_arrays(numpy,
+                                                                   self._actual)
+        count = int(outside.sum())
+        if count:
+            excess = numpy.where(numpy.isnan(excess), numpy.inf, excess)
+            excess = numpy.where(outside, excess, -numpy.inf)
+            worst = numpy.unravel_index(int(numpy.argmax(excess)), actual.shape)
+            worst = tuple([int(i) for i in worst])
+            if len(worst) == 1:
+                worst = worst[0]
+            self._violations = (count, actual.size, worst, actual[worst],
+                                difference[worst])
+        else:
+            self._violations = (0, actual.size, None, None, None)
+        return count == 0
 
     def message_for_failed_should(self):
+        if self._violations is not None:
+            count, size, worst, worst_actual, worst_difference = self._violations
+            return ("expected to be close to %s (within +/- %s), got %d of %d "
+                    "elements outside it, the worst at index %r: %s (off by %s)") % (
+                bounded(self._expected), bounded(self._delta), count, size, worst,
+                bounded(worst_actual), bounded(worst_difference))
         return "expected to be close to %s (within +/- %s), got %s" % (
-            self._expected, self._delta, self._actual)
+            bounded(self._expected), bounded(self._delta), bounded(self._actual))
 
     def message_for_failed_should_not(self):
+        if self._violations is not None:
+            return "expected not to be close to %s (within +/- %s), got all %d elements within it" % (
+                bounded(self._expected), bounded(self._delta), self._violations[1])
         return "expected not to be close to %s (within +/- %s), got %s" % (
-            self._expected, self._delta, self._actual)
+            bounded(self._expected), bounded(self._delta), bounded(self._actual))
 
 matcher(CloseTo)
+close_to = MatcherFactory(CloseTo)
 
 
 class Change(object):
@@ -451,15 +668,42 @@ class Change(object):
         self._from_to = False
         self._only_to = False
 
-    def __call__(self, verifier):
+    def __call__(self, verifier, snapshot='shallow'):
+        '''snapshot tells how the result is kept before running the action:
+        a shallow copy, a deep copy (so changes to nested values are seen),
+        or a digest of its contents, which only tells whether it changed'''
+        if snapshot not in ('shallow', 'deep', 'digest'):
+            raise ValueError('unknown snapshot %r' % (snapshot,))
         self._verifier = self._to_callable(verifier)
+        self._snapshot = snapshot
         return self
 
     def match(self, action):
         self._action = self._to_callable(action)
-        self._before_result = copy.copy(self._verifier())
+        self._take_snapshot(self._verifier())
         self._action()
-        self._after_result = self._verifier()
+        return self._compare_with_snapshot(self._verifier())
+
+    def _take_snapshot(self, result):
+        if self._snapshot == 'digest':
+            if self._by is not None or self._from_to or self._only_to:
+                raise TypeError("a digest only tells whether the result changed, "
+                                "use 'shallow' or 'deep' snapshots with by, from_ and to")
+            self._before_digest = content_digest(result)
+            return
+        import copy
+        if self._snapshot == 'deep':
+            self._before_result = copy.deepcopy(result)
+        else:
+            self._before_result = copy.copy(result)
+
+    def _compare_with_snapshot(self, result):
+        self._after_result = result
+        if self._snapshot == 'digest':
+            # the value before the action is not kept, but the one after it
+            # is enough for the failure messages
+            self._before_result = self._after_result
+            return content_digest(self._after_result) != self._before_digest
 
         if self._by is not None:
             self._actual_difference = self._after_result - self._before_result
@@ -479,44 +723,48 @@ class Change(object):
     def message_for_failed_should(self):
         if self._by is not None:
             return 'result should have changed %s %r, but was changed by %r' % (
-                self._by.name, self._expected_difference, self._actual_difference)
+                self._by.name, bounded(self._expected_difference), bounded(self._actual_difference))
         elif self._from_to:
             return 'result should have changed from %r to %r, but was changed from %r to %r' % (
-                self._from_value, self._to_value, self._before_result, self._after_result)
+                bounded(self._from_value), bounded(self._to_value),
+                bounded(self._before_result), bounded(self._after_result))
         elif self._only_to:
             if self._failure_on_to_initial_value:
                 return 'result should have been changed to %r, but is now %r' % (
-                    self._to_value, self._before_result)
+                    bounded(self._to_value), bounded(self._before_result))
             else:
                 return 'result should have changed to %r, but was changed to %r' % (
-                    self._to_value, self._after_result)
+                    bounded(self._to_value), bounded(self._after_result))
         else:
             return 'result should have changed, but is still %r' % (
-                self._before_result)
+                bounded(self._before_result))
 
     def message_for_failed_should_not(self):
         if self._from_to:
             return 'result should not have changed from %r to %r' % (
-                  self._from_value, self._to_value)
+                  bounded(self._from_value), bounded(self._to_value))
         elif self._only_to:
-            return 'result should not have changed to %r' % self._to_value
+            return 'result should not have changed to %r' % bounded(self._to_value)
+        elif self._snapshot == 'digest':
+            return 'should not have changed, but did change to %r' % (
+                bounded(self._after_result))
         else:
             return 'should not have changed, but did change from %r to %r' % (
-                self._before_result, self._after_result)
+                bounded(self._before_result), bounded(self._after_result))
 
     def by(self, difference):
         self._expected_difference = difference
-        self._by = Change._By(lambda exp_dif, act_dif: act_dif == exp_dif)
+        self._by = Change._By(operator.eq)
         return self
 
     def  by_at_least(self, difference):
         self._expected_difference = difference
-        self._by = Change._By(lambda exp_dif, act_dif: act_dif >= exp_dif, 'at least')
+        self._by = Change._By(operator.le, 'at least')
         return self
 
     def by_at_most(self, difference):
         self._expected_difference = difference
-        self._by = Change._By(lambda exp_dif, act_dif: act_dif <= exp_dif, 'at most')
+        self._by = Change._By(operator.ge, 'at most')
         return self
 
     def from_(self, from_value):
@@ -533,17 +781,349 @@ class Change(object):
         if callable(objekt):
             return objekt
         if getattr(objekt, '__getitem__', False) and len(objekt) >= 2 and callable(objekt[0]):
-            return lambda *params: objekt[0](*objekt[1:])
+            return partial(objekt[0], *objekt[1:])
         else:
             raise TypeError('parameter passed to change must be a callable ' +
                 'or a iterable having a callable as its first element')
 
     class _By(object):
+        # comparison is called as comparison(expected, actual)
         def __init__(self, comparison, name=''):
             self.name = ('by ' + name).strip()
             self.comparison = comparison
 
 matcher(Change)
+change = MatcherFactory(Change)
+
+
+class ChangeAll(object):
+    '''Several change expectations sharing a single run of the action:
+
+        action |should| change_all(counter_a).by(5).and_(counter_b).to(0)
+    '''
+
+    name = 'change_all'
+
+    def __call__(self, verifier, snapshot='shallow'):
+        self._changes = [Change()(verifier, snapshot)]
+        return self
+
+    def and_(self, verifier, snapshot='shallow'):
+        self._changes.append(Change()(verifier, snapshot))
+        return self
+
+    def by(self, difference):
+        self._changes[-1].by(difference)
+        return self
+
+    def by_at_least(self, difference):
+        self._changes[-1].by_at_least(difference)
+        return self
+
+    def by_at_most(self, difference):
+        self._changes[-1].by_at_most(difference)
+        return self
+
+    def from_(self, from_value):
+        self._changes[-1].from_(from_value)
+        return self
+
+    def to(self, to_value):
+        self._changes[-1].to(to_value)
+        return self
+
+    def match(self, action):
+        action = self._changes[0]._to_callable(action)
+        for change in self._changes:
+            change._take_snapshot(change._verifier())
+        action()
+        return self._compare_with_snapshots([change._verifier()
+                                             for change in self._changes])
+
+    def _compare_with_snapshots(self, results):
+        self._results = [change._compare_with_snapshot(result)
+                         for change, result in zip(self._changes, results)]
+        return False not in self._results
+
+    def message_for_failed_should(self):
+        failures = [(index, change.message_for_failed_should())
+                    for index, (change, result)
+                    in enumerate(zip(self._changes, self._results))
+                    if not result]
+        return '%d of %d changes failed:\n%s' % (len(failures),
+            len(self._changes), self._join(failures))
+
+    def message_for_failed_should_not(self):
+        return 'all %d changes happened:\n%s' % (len(self._changes),
+            self._join([(index, change.message_for_failed_should_not())
+                        for index, change in enumerate(self._changes)]))
+
+    def _join(self, messages):
+        return '\n'.join(['  [%d] %s' % item for item in messages])
+
+matcher(ChangeAll)
+change_all = MatcherFactory(ChangeAll)
+
+
+class Eventually(object):
+    '''Calls the actual value until the given matcher matches its result,
+    waiting between calls an interval which grows by backoff up to
+    max_interval, and giving up after timeout seconds'''
+
+    name = 'eventually'
+
+    def __call__(self, matcher, timeout=5.0, interval=0.01, backoff=2.0,
+                 max_interval=1.0):
+        self._matcher = _as_matcher(matcher)
+        self._timeout = timeout
+        self._interval = interval
+        self._backoff = backoff
+        self._max_interval = max_interval
+        return self
+
+    def match(self, function):
+        import time
+        self._start(function)
+        while True:
+            wait = self._attempt(function())
+            if wait is None:
+                return self._matched
+            time.sleep(wait)
+
+    def _start(self, function):
+        if not callable(function):
+            raise TypeError('eventually needs a callable returning the value '
+                            'to be matched, got %r' % bounded(function))
+        # run the way eventually does, so matchers like include_keys have
+        # their should_not messages ready
+        _inject_negate_information(self._matcher,
+                                   getattr(self, 'run_with_negate', False))
+        self._deadline = default_timer() + self._timeout
+        self._next_interval = self._interval
+        self._attempts = 0
+
+    def _attempt(self, value):
+        '''Checks a value, returning how long to wait for the next attempt,
+        or None if there is no need for another one'''
+        self._attempts += 1
+        self._last_value = value
+        self._matched = bool(self._matcher.match(value))
+        remaining = self._deadline - default_timer()
+        if self._matched or remaining <= 0:
+            return None
+        wait = min(self._next_interval, remaining)
+        self._next_interval = min(self._next_interval * self._backoff,
+                                  self._max_interval)
+        return wait
+
+    def message_for_failed_should(self):
+        return 'expected to match within %s seconds, but after %d attempts the last value was %r: %s' % (
+            self._timeout, self._attempts, bounded(self._last_value),
+            self._matcher.message_for_failed_should())
+
+    def message_for_failed_should_not(self):
+        return 'expected not to match within %s seconds, but matched after %d attempts: %s' % (
+            self._timeout, self._attempts,
+            self._matcher.message_for_failed_should_not())
+
+matcher(Eventually)
+eventually = MatcherFactory(Eventually)
+
+
+class CompleteWithin(object):
+    '''Times runs of a callable (or of (callable, arg1, arg2, ...)) after
+    some warm-up runs, matching if the given percentile of the run times (the
+    slowest, by default) is within the given seconds'''
+
+    name = 'complete_within'
+
+    def __call__(self, seconds, runs=1, percentile=100, warmup=0):
+        if runs < 1:
+            raise ValueError('runs must be at least 1, got %r' % (runs,))
+        if not 0 <= percentile <= 100:
+            raise ValueError('percentile must be between 0 and 100, got %r' % (percentile,))
+        self._seconds = seconds
+        self._runs = runs
+        self._percentile = percentile
+        self._warmup = warmup
+        return self
+
+    def match(self, lvalue):
+        function, args = _function_and_args(lvalue)
+        for run in range(self._warmup):
+            function(*args)
+        times = []
+        for run in range(self._runs):
+            # default_timer is time.perf_counter on Python 3
+            started = default_timer()
+            function(*args)
+            times.append(default_timer() - started)
+        self._times = sorted(times)
+        self._measured = _percentile(self._times, self._percentile)
+        return self._measured <= self._seconds
+
+    def message_for_failed_should(self):
+        return 'expected %s to complete within %s, took %s (%s)' % (
+            self._description(), _format_seconds(self._seconds),
+            _format_seconds(self._measured), self._statistics())
+
+    def message_for_failed_should_not(self):
+        return 'expected %s not to complete within %s, took %s (%s)' % (
+            self._description(), _format_seconds(self._seconds),
+            _format_seconds(self._measured), self._statistics())
+
+    def _description(self):
+        if self._runs == 1:
+            return 'the call'
+        if self._percentile == 100:
+            statistic = 'the slowest'
+        elif self._percentile == 50:
+            statistic = 'the median'
+        else:
+            statistic = 'the p%g' % self._percentile
+        return '%s of %d runs' % (statistic, self._runs)
+
+    def _statistics(self):
+        times = self._times
+        return 'min %s, median %s, p95 %s, max %s' % tuple([_format_seconds(t)
+            for t in (times[0], _percentile(times, 50), _percentile(times, 95),
+                      times[-1])])
+
+def _percentile(sorted_values, percentile):
+    '''Percentile of sorted values, interpolating between the closest
+    ranks'''
+    position = (len(sorted_values) - 1) * percentile / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (
+        sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def _format_seconds(seconds):
+    if seconds < 0.001:
+        return '%.3g us' % (seconds * 1e6)
+    if seconds < 1:
+        return '%.3g ms' % (seconds * 1e3)
+    return '%.3g s' % seconds
+
+matcher(CompleteWithin)
+complete_within = MatcherFactory(CompleteWithin)
+
+
+def content_digest(value):
+    '''Returns a digest of the contents of a value, walking containers and
+    object attributes and hashing them as it goes. Mappings and sets are
+    digested regardless of their order'''
+    import hashlib
+    content = _ContentDigest(hashlib.sha1)
+    content.update(value)
+    return content.digest()
+
+class _ContentDigest(object):
+
+    _chunk_size = 1 << 16
+
+    def __init__(self, new_digest, visiting=None):
+        self._new_digest = new_digest
+        self._digest = new_digest()
+        if visiting is None:
+            visiting = set()
+        self._visiting = visiting
+
+    def digest(self):
+        return self._digest.digest()
+
+    def update(self, value):
+        digest = self._digest
+        value_type = type(value)
+        digest.update(('\0%s.%s:' % (value_type.__module__,
+            getattr(value_type, '__name__', ''))).encode('utf-8'))
+        if isinstance(value, (bytes, bytearray)):
+            self._update_in_chunks(value)
+        elif isinstance(value, string_types):
+            self._update_in_chunks(value.encode('utf-8', 'surrogatepass'))
+        elif value is None or isinstance(value, (bool, numbers.Number)):
+            digest.update(repr(value).encode('utf-8'))
+        elif id(value) in self._visiting:
+            digest.update(b'<cycle>')
+        else:
+            self._visiting.add(id(value))
+            try:
+                self._update_container(value)
+            finally:
+                self._visiting.discard(id(value))
+
+    def _update_container(self, value):
+        numpy = sys.modules.get('numpy')
+        if numpy is not None and isinstance(value, numpy.ndarray):
+            self._digest.update(repr((value.dtype.str, value.shape)).encode('utf-8'))
+            if value.dtype.hasobject:
+                for element in value.flat:
+                    self.update(element)
+            else:
+                self._digest.update(numpy.ascontiguousarray(value).tobytes())
+        elif isinstance(value, Mapping):
+            self._update_unordered([(key, value[key]) for key in value])
+        elif isinstance(value, (set, frozenset)):
+            self._update_unordered(value)
+        elif isinstance(value, (list, tuple, deque)):
+            self._digest.update(str(len(value)).encode('utf-8'))
+            for element in value:
+                self.update(element)
+        else:
+            attributes = _attributes_of(value)
+            if attributes is not None:
+                self._update_unordered(attributes.items())
+            elif type(value).__repr__ is not object.__repr__:
+                self._digest.update(repr(value).encode('utf-8'))
+            else:
+                # the default repr only tells the object identity
+                raise TypeError('cannot digest %s objects, which have neither '
+                                'attributes nor a repr of their own' %
+                                type(value).__name__)
+
+    def _update_unordered(self, elements):
+        # element digests are summed, so the order of the elements is ignored
+        total = 0
+        for element in elements:
+            element_digest = _ContentDigest(self._new_digest, self._visiting)
+            element_digest.update(element)
+            total += int(element_digest._digest.hexdigest(), 16)
+        self._digest.update(('%x' % total).encode('ascii'))
+
+    def _update_in_chunks(self, data):
+        for start in range(0, len(data), self._chunk_size):
+            self._digest.update(data[start:start + self._chunk_size])
+
+
+def _attributes_of(value):
+    '''Returns a dict of the attributes of an object, from its __dict__ and
+    its __slots__, or None if it has neither'''
+    attributes = getattr(value, '__dict__', None)
+    slots = _slots_of(type(value))
+    if attributes is None and not slots:
+        return None
+    attributes = dict(attributes or ())
+    for name in slots:
+        slot_value = getattr(value, name, _UNSET)
+        if slot_value is not _UNSET:
+            attributes[name] = slot_value
+    return attributes
+
+_UNSET = object()
+
+def _slots_of(klass):
+    names = []
+    for base in getattr(klass, '__mro__', ()):
+        slots = vars(base).get('__slots__', ())
+        if isinstance(slots, string_types):
+            slots = (slots,)
+        for name in slots:
+            if name in ('__dict__', '__weakref__'):
+                continue
+            if name.startswith('__') and not name.endswith('__'):
+                name = '_%s%s' % (base.__name__.lstrip('_'), name)
+            names.append(name)
+    return names
 
 
 # matchers for backwards compatibility
@@ -577,14 +1157,18 @@ def thrown_by():
     return be_thrown_by()
 
 
-@matcher
-def in_any_order():
-    return include_in_any_order()
+class InAnyOrder(IncludeInAnyOrder):
+    name = 'in_any_order'
 
+matcher(InAnyOrder)
+in_any_order = MatcherFactory(InAnyOrder)
 
-@matcher
-def all_of():
-    return include_all_of()
+
+class AllOf(IncludeAllOf):
+    name = 'all_of'
+
+matcher(AllOf)
+all_of = MatcherFactory(AllOf)
 
 
 @matcher
@@ -606,6 +1190,7 @@ class Like(BeLike):
     name = 'like'
 
 matcher(Like)
+like = MatcherFactory(Like)
 
 
 class IncludeDictElement(object):
@@ -616,7 +1201,7 @@ class IncludeDictElement(object):
 
     def match(self, dictionary):
         self._ensure_it_is_really_a_dict(dictionary)
-        self._actual_elements = self._get_element_values(dictionary)
+        self._actual_elements = self._elements_of(dictionary)
         self._undesired_elements = []
         if self.run_with_negate:
             self._undesired_elements = [elem for elem in self._expected_elements if elem in self._actual_elements]
@@ -637,16 +1222,10 @@ class IncludeDictElement(object):
         return len(self._undesired_elements) > 1 and ('%ss' % self._element_name) or self._element_name
 
     def _humanize_undesired_elements(self):
-        list_ = self._undesired_elements
-        if len(list_) == 1:
-            return repr(list_[0])
-        list_ = [repr(x) for x in list_]
-        last = list_.pop()
-        list_[-1] = "%s and %s" % (list_[-1], last)
-        return ', '.join(list_)
+        return humanize_elements(self._undesired_elements)
 
     def _ensure_it_is_really_a_dict(self, target):
-        if not isinstance(target, dict):
+        if not isinstance(target, Mapping):
             raise TypeError('target must be a dictionary')
 
 
@@ -656,10 +1235,13 @@ class IncludeKeys(IncludeDictElement):
 
     def __init__(self):
         self._element_name = 'key'
-        self._get_element_values = lambda d: d.keys()
+
+    def _elements_of(self, mapping):
+        return mapping
 
 
 matcher(IncludeKeys)
+include_keys = MatcherFactory(IncludeKeys)
 
 
 class IncludeValues(IncludeDictElement):
@@ -668,10 +1250,77 @@ class IncludeValues(IncludeDictElement):
 
     def __init__(self):
         self._element_name = 'value'
-        self._get_element_values = lambda d: d.values()
+
+    def _elements_of(self, mapping):
+        values = mapping.values()
+        if len(self._expected_elements) > 1:
+            return ElementIndex(values)
+        return values
 
 
 matcher(IncludeValues)
+include_values = MatcherFactory(IncludeValues)
+
+
+class Each(object):
+
+    name = 'each'
+
+    def __call__(self, matcher):
+        self._matcher = _as_matcher(matcher)
+        return self
+
+    def match(self, values):
+        try:
+            self._matcher.run_with_negate = False
+        except AttributeError:
+            pass
+        mask = self._elements_mask(values)
+        if mask is not None:
+            return self._match_mask(values, mask)
+        self._checked = 0
+        for index, value in enumerate(values):
+            self._checked += 1
+            if not self._matcher.match(value):
+                self._failed_index = index
+                return False
+        return True
+
+    def _elements_mask(self, values):
+        numpy = sys.modules.get('numpy')
+        if numpy is None or not isinstance(values, numpy.ndarray):
+            return None
+        # looked up on the class, as matchers like have answer any attribute
+        match_elements = getattr(type(self._matcher), 'match_elements', None)
+        if match_elements is None:
+            return None
+        mask = match_elements(self._matcher, values)
+        if (not isinstance(mask, numpy.ndarray) or mask.dtype != bool or
+                mask.shape != values.shape):
+            return None
+        return mask
+
+    def _match_mask(self, values, mask):
+        self._checked = mask.size
+        if mask.all():
+            return True
+        failed = sys.modules['numpy'].argwhere(~mask)[0]
+        if len(failed) == 1:
+            self._failed_index = int(failed[0])
+        else:
+            self._failed_index = tuple([int(i) for i in failed])
+        self._matcher.match(values[self._failed_index])
+        return False
+
+    def message_for_failed_should(self):
+        return "expected each element to match, but element at index %r did not: %s" % (
+            self._failed_index, self._matcher.message_for_failed_should())
+
+    def message_for_failed_should_not(self):
+        return "expected some element not to match, but all %d did" % self._checked
+
+matcher(Each)
+each = MatcherFactory(Each)
 
 
 class BeEmpty(object):
@@ -686,13 +1335,14 @@ class BeEmpty(object):
         return len(container) == 0
 
     def message_for_failed_should(self):
-        return "expected %s to be empty" % repr(self._container)
+        return "expected %s to be empty" % bounded_repr(self._container)
 
     def message_for_failed_should_not(self):
-        return "expected %s not to be empty" % repr(self._container)
+        return "expected %s not to be empty" % bounded_repr(self._container)
 
 
 matcher(BeEmpty)
+be_empty = MatcherFactory(BeEmpty)
 
 class HaveSameAttributeValues(object):
 
@@ -716,9 +1366,143 @@ class HaveSameAttributeValues(object):
         return found_different_attribute == False
 
     def message_for_failed_should(self):
-        return "expected %r to have the same attribute values as %r" % (self._actual_object, self._other_object)
+        return "expected %r to have the same attribute values as %r" % (bounded(self._actual_object), bounded(self._other_object))
 
     def message_for_failed_should_not(self):
-        return "expected %r to have not the same attribute values as %r" % (self._actual_object, self._other_object)
+        return "expected %r to have not the same attribute values as %r" % (bounded(self._actual_object), bounded(self._other_object))
 
 matcher(HaveSameAttributeValues)
+have_same_attribute_values_as = MatcherFactory(HaveSameAttributeValues)
+
+
+class _MatcherCombinator(object):
+    '''Base for matchers combining other matchers, which are checked in order
+    until the result is known. With adaptive=True, the matchers are reordered
+    from time to time, by how long they take and how often they decide the
+    result, so the cheap and decisive ones run first'''
+
+    reorder_every = 64
+
+    def __call__(self, *matchers, **options):
+        self.adaptive = options.pop('adaptive', False)
+        if options:
+            raise TypeError('unexpected option %r' % list(options)[0])
+        # each entry is [matcher, calls, decisions, total time]
+        self._entries = [[_as_matcher(m), 0, 0, 0.0] for m in matchers]
+        self._evaluations = 0
+        return self
+
+    @property
+    def matchers(self):
+        '''The combined matchers, in the order they are checked'''
+        return [entry[0] for entry in self._entries]
+
+    def match(self, value):
+        self._value = value
+        # the matchers run the way the combinator does, so the ones which
+        # build their messages while matching (like include_keys) are ready
+        # for should_not
+        negate = getattr(self, 'run_with_negate', False)
+        if self.adaptive:
+            return self._match_adaptively(value, negate)
+        for entry in self._entries:
+            matcher = entry[0]
+            _inject_negate_information(matcher, negate)
+            if bool(matcher.match(value)) == self._decisive_result:
+                self._decided_by = matcher
+                return self._decisive_result
+        return not self._decisive_result
+
+    def _match_adaptively(self, value, negate):
+        result = not self._decisive_result
+        self._decided_by = None
+        for entry in self._entries:
+            matcher = entry[0]
+            _inject_negate_information(matcher, negate)
+            started = default_timer()
+            matched = bool(matcher.match(value))
+            entry[3] += default_timer() - started
+            entry[1] += 1
+            if matched == self._decisive_result:
+                entry[2] += 1
+                self._decided_by = matcher
+                result = self._decisive_result
+                break
+        self._evaluations += 1
+        if self._evaluations % self.reorder_every == 0:
+            self._entries.sort(key=self._expected_cost)
+        return result
+
+    def _expected_cost(self, entry):
+        matcher, calls, decisions, total_time = entry
+        if not calls:
+            return 0.0
+        # smoothed, so matchers which never decided still get a chance
+        decision_rate = (decisions + 1.0) / (calls + 2.0)
+        return total_time / calls / decision_rate
+
+    def _names(self):
+        return ', '.join([_matcher_name(m) for m in self.matchers])
+
+
+def _matcher_name(matcher):
+    return getattr(matcher, 'name', type(matcher).__name__)
+
+
+class AllOfMatchers(_MatcherCombinator):
+
+    name = 'all_of_matchers'
+    _decisive_result = False
+
+    def message_for_failed_should(self):
+        return 'expected all matchers to match, but %s did not: %s' % (
+            _matcher_name(self._decided_by),
+            self._decided_by.message_for_failed_should())
+
+    def message_for_failed_should_not(self):
+        return 'expected some matcher not to match %r, but all did (%s)' % (
+            bounded(self._value), self._names())
+
+matcher(AllOfMatchers)
+all_of_matchers = MatcherFactory(AllOfMatchers)
+
+
+class AnyOfMatchers(_MatcherCombinator):
+
+    name = 'any_of_matchers'
+    _decisive_result = True
+
+    def message_for_failed_should(self):
+        return 'expected some matcher to match %r, but none did (%s)' % (
+            bounded(self._value), self._names())
+
+    def message_for_failed_should_not(self):
+        return 'expected no matcher to match, but %s did: %s' % (
+            _matcher_name(self._decided_by),
+            self._decided_by.message_for_failed_should_not())
+
+matcher(AnyOfMatchers)
+any_of_matchers = MatcherFactory(AnyOfMatchers)
+
+
+class Negated(object):
+
+    name = 'negated'
+
+    def __call__(self, matcher):
+        self._matcher = _as_matcher(matcher)
+        return self
+
+    def match(self, value):
+        negate = not getattr(self, 'run_with_negate', False)
+        _inject_negate_information(self._matcher, negate)
+        return not self._matcher.match(value)
+
+    def message_for_failed_should(self):
+        return self._matcher.message_for_failed_should_not()
+
+    def message_for_failed_should_not(self):
+        return self._matcher.message_for_failed_should()
+
+matcher(Negated)
+negated = MatcherFactory(Negated)
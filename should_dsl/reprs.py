@@ -0,0 +1,211 @@
+'''Size-bounded reprs for failure messages.
+
+Failure messages show the values involved in an expectation, which can be
+huge (a list with millions of items, a multi-megabyte string). The functions
+below build reprs limited in length, nesting depth and number of items, so a
+failing expectation does not stall building its message. Custom matchers can
+use them too.
+'''
+
+from collections import deque
+from itertools import islice
+from numbers import Number
+from should_dsl.backwardscompat import Repr, integer_types, string_types
+
+# log10(2): how many decimal digits each bit of an int adds
+_DIGITS_PER_BIT = 0.30102999566398120
+
+
+class BoundedRepr(Repr):
+    '''Repr with limits suited to failure messages, which keeps the
+    original order of dicts and sets and accepts reprs for given types'''
+
+    def __init__(self):
+        Repr.__init__(self)
+        self.maxlevel = 6
+        self.maxtuple = self.maxlist = self.maxarray = self.maxdeque = 100
+        self.maxdict = self.maxset = self.maxfrozenset = 100
+        self.maxstring = self.maxother = 1000
+        self.maxlong = 200
+        self._reprs_by_type = {}
+        self._containers_by_type = {}
+
+    def add_repr_for_type(self, type_, function):
+        self._reprs_by_type[type_] = function
+
+    def repr1(self, x, level):
+        klass = type(x)
+        if self._reprs_by_type:
+            for base in klass.__mro__:
+                function = self._reprs_by_type.get(base)
+                if function is not None:
+                    return self.truncate(function(x), self.maxother)
+        try:
+            container = self._containers_by_type[klass]
+        except KeyError:
+            container = self._containers_by_type[klass] = self._container_of(klass)
+        if container is not None:
+            return self._repr_container_subclass(x, level, container)
+        return Repr.repr1(self, x, level)
+
+    def _container_of(self, klass):
+        '''Returns the built-in container klass derives from, if it is a
+        subclass of one. Repr dispatches on the type name, so subclasses
+        would get their whole repr built before being truncated'''
+        for container in _CONTAINERS:
+            if klass is not container and issubclass(klass, container):
+                return container
+        return None
+
+    def _repr_container_subclass(self, x, level, container):
+        repr_container = getattr(self, 'repr_' + container.__name__)
+        if type(x).__repr__ is container.__repr__:
+            return repr_container(x, level)
+        if container is tuple and hasattr(x, '_fields'):
+            return self._repr_namedtuple(x, level)
+        if not x:
+            return '%s()' % type(x).__name__
+        return '%s(%s)' % (type(x).__name__, repr_container(x, level))
+
+    def _repr_namedtuple(self, x, level):
+        if level <= 0:
+            return '%s(...)' % type(x).__name__
+        pieces = ['%s=%s' % (field, self.repr1(value, level - 1))
+                  for field, value in islice(zip(x._fields, x), self.maxtuple)]
+        if len(x) > self.maxtuple:
+            pieces.append('...')
+        return '%s(%s)' % (type(x).__name__, ', '.join(pieces))
+
+    def repr_set(self, x, level):
+        if not x:
+            return 'set()'
+        return self._repr_iterable(x, level, '{', '}', self.maxset)
+
+    def repr_frozenset(self, x, level):
+        if not x:
+            return 'frozenset()'
+        return self._repr_iterable(x, level, 'frozenset({', '})', self.maxfrozenset)
+
+    def repr_dict(self, x, level):
+        if not x:
+            return '{}'
+        if level <= 0:
+            return '{...}'
+        pieces = ['%s: %s' % (self.repr1(key, level - 1), self.repr1(x[key], level - 1))
+                  for key in islice(x, self.maxdict)]
+        if len(x) > self.maxdict:
+            pieces.append('...')
+        return '{%s}' % ', '.join(pieces)
+
+    def repr_bytes(self, x, level):
+        return self.repr_str(x, level)
+
+    def repr_int(self, x, level):
+        if _is_small_int(x):
+            return self.truncate(repr(x), self.maxlong)
+        # repr() of huge ints is slow, and refused past sys.int_max_str_digits,
+        # so only the leading and trailing digits are computed
+        sign = x < 0 and '-' or ''
+        x = abs(x)
+        digits = int((x.bit_length() - 1) * _DIGITS_PER_BIT) + 1
+        if x >= 10 ** digits:
+            digits += 1
+        if len(sign) + digits <= self.maxlong:
+            return sign + str(x)
+        size = self.maxlong - len(sign)
+        head = max(0, (size - 3) // 2)
+        tail = max(0, size - 3 - head)
+        text = sign
+        if head:
+            text += str(x // 10 ** (digits - head))
+        text += '...'
+        if tail:
+            text += str(x % 10 ** tail).zfill(tail)
+        return text
+
+    repr_long = repr_int
+
+    def truncate(self, text, size):
+        if len(text) <= size:
+            return text
+        head = max(0, (size - 3) // 2)
+        tail = max(0, size - 3 - head)
+        return text[:head] + '...' + text[len(text) - tail:]
+
+
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+
+_bounded = BoundedRepr()
+
+
+class _BoundedValue(object):
+    '''Formats a value through bounded_repr and bounded_str, so it can be
+    given to a %r or %s placeholder'''
+
+    def __init__(self, value):
+        self._value = value
+
+    def __repr__(self):
+        return bounded_repr(self._value)
+
+    def __str__(self):
+        return bounded_str(self._value)
+
+
+def bounded_repr(value):
+    '''repr() limited in length, nesting and number of items'''
+    return _bounded.repr(value)
+
+def bounded_str(value):
+    '''str() limited in length, nesting and number of items'''
+    if isinstance(value, string_types):
+        return _bounded.truncate(value, _bounded.maxstring)
+    if isinstance(value, _CONTAINERS):
+        return _bounded.repr(value)
+    try:
+        text = str(value)
+    except Exception:
+        return _bounded.repr(value)
+    return _bounded.truncate(text, _bounded.maxother)
+
+def bounded(value):
+    '''Wraps value to be bounded when formatted with %r or %s. Numbers other
+    than ints too long for maxlong are returned as they are, so %d and %f
+    placeholders keep working'''
+    if isinstance(value, integer_types):
+        if _is_small_int(value):
+            return value
+    elif isinstance(value, Number):
+        return value
+    return _BoundedValue(value)
+
+def _is_small_int(value):
+    '''Tells whether the repr of an int surely fits in maxlong characters'''
+    return value.bit_length() * _DIGITS_PER_BIT < _bounded.maxlong - 1
+
+def humanize_elements(elements):
+    '''Joins the bounded reprs of elements as "1, 2 and 3", listing at most
+    as many elements as a bounded list repr would'''
+    elements = list(elements)
+    list_ = [bounded_repr(x) for x in elements[:_bounded.maxlist]]
+    if len(elements) > len(list_):
+        list_.append('%d more' % (len(elements) - len(list_)))
+    if len(list_) == 1:
+        return list_[0]
+    last = list_.pop()
+    list_[-1] = "%s and %s" % (list_[-1], last)
+    return ', '.join(list_)
+
+def repr_configuration(**limits):
+    '''Sets the limits of bounded reprs: maxlevel, maxstring, maxother,
+    maxlong, maxlist, maxtuple, maxdict, maxset, maxfrozenset, maxdeque
+    and maxarray'''
+    for name, value in limits.items():
+        if not name.startswith('max') or not hasattr(_bounded, name):
+            raise TypeError('unknown repr limit %r' % name)
+        setattr(_bounded, name, value)
+
+def add_repr_for_type(type_, function):
+    '''Uses function(value) as the repr of values of type_ (and its
+    subclasses) in failure messages. Its result is still cut at maxother'''
+    _bounded.add_repr_for_type(type_, function)
@@ -0,0 +1,233 @@
+r'''Record validators built from matchers.
+
+A schema maps field names to matchers:
+
+    validator = RecordValidator({'id': be_instance_of(int),
+                                 'price': close_to(10, 5),
+                                 'name': be_like(r'\w+')})
+
+The matchers are prepared once, when the validator is created, and reused
+for every record, so validating a record doesn't create matchers, inspect
+frames or raise exceptions. The validator counts how many records it checked,
+how many were rejected and how many times each field failed.
+
+Matchers keep the last checked value to build their messages, so a validator
+must not be shared among threads.
+
+verify_all() checks every value of an iterable against a matcher, sharing
+the work among processes.
+'''
+
+from collections import deque
+from itertools import islice
+from should_dsl.dsl import (_as_matcher, _inject_negate_information,
+                            ShouldNotSatisfied)
+from should_dsl.reprs import bounded
+
+
+class RecordValidator(object):
+    '''Validates mappings (usually dicts) against a schema of field names
+    to matchers. A record missing a field fails that field'''
+
+    def __init__(self, schema):
+        self._checks = []
+        for field, matcher in schema.items():
+            matcher = _as_matcher(matcher)
+            _inject_negate_information(matcher, False)
+            self._checks.append((field, matcher, matcher.match))
+        self.fields = [field for field, matcher, match in self._checks]
+        self.reset()
+
+    def reset(self):
+        '''Clears the counters'''
+        self.checked = 0
+        self.rejected = 0
+        self.failure_counts = dict((field, 0) for field in self.fields)
+
+    def is_valid(self, record):
+        '''Returns whether the record satisfies every field. It stops on the
+        first failing field and doesn't change the counters'''
+        for field, matcher, match in self._checks:
+            try:
+                value = record[field]
+            except KeyError:
+                return False
+            if not match(value):
+                return False
+        return True
+
+    def failed_fields(self, record):
+        '''Returns the list of fields the record fails, updating the
+        counters'''
+        failed = []
+        for field, matcher, match in self._checks:
+            try:
+                value = record[field]
+            except KeyError:
+                failed.append(field)
+                continue
+            if not match(value):
+                failed.append(field)
+        self.checked += 1
+        if failed:
+            self.rejected += 1
+            failure_counts = self.failure_counts
+            for field in failed:
+                failure_counts[field] += 1
+        return failed
+
+    def failures(self, record):
+        '''Returns a list of (field, message) for the fields the record
+        fails, without changing the counters'''
+        failures = []
+        for field, matcher, match in self._checks:
+            try:
+                value = record[field]
+            except KeyError:
+                failures.append((field, 'missing field %r' % bounded(field)))
+                continue
+            if not match(value):
+                failures.append((field, matcher.message_for_failed_should()))
+        return failures
+
+    def validate(self, record):
+        '''Raises ShouldNotSatisfied describing the failing fields, if any'''
+        failures = self.failures(record)
+        if failures:
+            raise ShouldNotSatisfied('\n'.join(
+                ['%s: %s' % (field, message) for field, message in failures]))
+
+    def valid(self, records):
+        '''Yields the valid records of an iterable (a generator, for
+        instance), counting the failures of the invalid ones'''
+        failed_fields = self.failed_fields
+        for record in records:
+            if not failed_fields(record):
+                yield record
+
+    def invalid(self, records):
+        '''Yields (record, failed fields) for the invalid records of an
+        iterable, counting their failures'''
+        failed_fields = self.failed_fields
+        for record in records:
+            failed = failed_fields(record)
+            if failed:
+                yield record, failed
+
+    def report(self):
+        '''Returns a text summary of the counters'''
+        lines = ['%d records checked, %d rejected' % (self.checked,
+                                                      self.rejected)]
+        for field in self.fields:
+            lines.append('  %s: %d failures' % (field,
+                                                self.failure_counts[field]))
+        return '\n'.join(lines)
+
+
+class VerificationSummary(object):
+    '''Result of verify_all(). It is true when every value satisfied the
+    matcher, and keeps the index and message of the first failures'''
+
+    def __init__(self, max_failures):
+        self.checked = 0
+        self.failed = 0
+        self.failures = []
+        self._max_failures = max_failures
+
+    def __bool__(self):
+        return self.failed == 0
+    __nonzero__ = __bool__
+
+    def _add(self, chunk_result):
+        checked, failed, failures = chunk_result
+        self.checked += checked
+        self.failed += failed
+        room = self._max_failures - len(self.failures)
+        if room > 0:
+            self.failures.extend(failures[:room])
+
+    def __str__(self):
+        lines = ['%d values checked, %d failed' % (self.checked, self.failed)]
+        for index, message in self.failures:
+            lines.append('  [%d] %s' % (index, message))
+        if self.failed > len(self.failures):
+            lines.append('  ... %d more' % (self.failed - len(self.failures)))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return '<VerificationSummary %d checked, %d failed>' % (self.checked,
+                                                               self.failed)
+
+
+def _verify_chunk(matcher, negate, max_failures, start, values):
+    failed = 0
+    failures = []
+    match = matcher.match
+    for index, value in enumerate(values):
+        if bool(match(value)) == negate:
+            failed += 1
+            if len(failures) < max_failures:
+                if negate:
+                    message = matcher.message_for_failed_should_not()
+                else:
+                    message = matcher.message_for_failed_should()
+                failures.append((start + index, message))
+    return len(values), failed, failures
+
+_worker_arguments = None
+
+def _initialize_worker(matcher, negate, max_failures):
+    global _worker_arguments
+    _worker_arguments = (matcher, negate, max_failures)
+
+def _verify_chunk_in_worker(start, values):
+    return _verify_chunk(*(_worker_arguments + (start, values)))
+
+def _chunks(values, chunk_size):
+    iterator = iter(values)
+    start = 0
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+def verify_all(values, matcher, workers=None, chunk_size=10000, negate=False,
+               max_failures=100):
+    '''Checks every value of an iterable against a matcher (or against
+    should_not, if negate is true) and returns a VerificationSummary.
+
+    The values are split in chunks of chunk_size, checked by a pool of
+    workers processes (as many as CPUs, by default). The matcher is sent to
+    the workers once, so it must be picklable. With workers=1, the values
+    are checked in the current process. Only a few chunks are read ahead, so
+    values can come from a generator larger than the memory'''
+    matcher = _as_matcher(matcher)
+    _inject_negate_information(matcher, negate)
+    summary = VerificationSummary(max_failures)
+    if workers == 1:
+        for start, chunk in _chunks(values, chunk_size):
+            summary._add(_verify_chunk(matcher, negate, max_failures,
+                                       start, chunk))
+        return summary
+
+    import multiprocessing
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers, _initialize_worker,
+                                (matcher, negate, max_failures))
+    try:
+        pending = deque()
+        for start, chunk in _chunks(values, chunk_size):
+            pending.append(pool.apply_async(_verify_chunk_in_worker,
+                                            (start, chunk)))
+            if len(pending) > 2 * workers:
+                summary._add(pending.popleft().get())
+        while pending:
+            summary._add(pending.popleft().get())
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return summary